@@ -0,0 +1,233 @@
+"""End-to-end benchmarks of the parsing and preprocessing stages over a synthetic
+corpus.
+
+    python run_bench.py --preset small
+    python run_bench.py --routes 1000 --points 5000 --save-baseline
+
+Every stage runs in its own process, so its peak RSS is its own. Results are
+compared against the baseline saved for the same corpus parameters.
+"""
+import argparse
+import contextlib
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import simplejson
+
+bench_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(bench_root, '..', 'mtbbg'))
+sys.path.insert(0, os.path.join(bench_root, '..', 'preprocessor'))
+
+import synthetic  # noqa: E402
+
+PRESETS = {
+    'small': (100, 1000),
+    'medium': (10000, 100),
+    'large': (100000, 100),
+}
+# Stages faster than this are mostly timer noise, so they're never regressions.
+MIN_SECONDS = 0.05
+STAGES = ['parse_page', 'extract_segments', 'segment_to_polyline', 'encode', 'write_routes']
+
+
+class Timer(object):
+    def __init__(self):
+        self.seconds = 0.0
+
+    @contextlib.contextmanager
+    def measure(self):
+        start = time.perf_counter()
+        yield
+        self.seconds += time.perf_counter() - start
+
+
+def quiet_segments(path):
+    # extract_segments prints every file it opens.
+    import main
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return list(main.extract_segments(path))
+
+
+def stage_parse_page(page_paths, trace_paths, timer):
+    import route_parser
+    contents = []
+    for i, path in enumerate(page_paths):
+        with open(path, encoding='utf-8') as f:
+            contents.append((synthetic.page_url(i), f.read()))
+    with timer.measure():
+        results = [route_parser.parse_page(url, content, False) for url, content in contents]
+    if any(route is None for route, _ in results):
+        raise Exception('parse_page missed a synthetic route')
+    return len(simplejson.dumps([route for route, _ in results]))
+
+
+def stage_extract_segments(page_paths, trace_paths, timer):
+    output = 0
+    for path in trace_paths:
+        with timer.measure():
+            segments = quiet_segments(path)
+        output += sum(segment.nbytes for segment in segments)
+    return output
+
+
+def simplified(path):
+    import main
+    return [main.segment_to_polyline(segment[:, :2]) for segment in quiet_segments(path)]
+
+
+def stage_segment_to_polyline(page_paths, trace_paths, timer):
+    import main
+    output = 0
+    for path in trace_paths:
+        segments = [segment[:, :2] for segment in quiet_segments(path)]
+        with timer.measure():
+            polylines = [main.segment_to_polyline(segment) for segment in segments]
+        output += sum(polyline.nbytes for polyline in polylines)
+    return output
+
+
+def stage_encode(page_paths, trace_paths, timer):
+    from polyline_codec import encode
+    output = 0
+    for path in trace_paths:
+        polylines = simplified(path)
+        with timer.measure():
+            encoded = [encode(polyline) for polyline in polylines]
+        output += sum(map(len, encoded))
+    return output
+
+
+def stage_write_routes(page_paths, trace_paths, timer):
+    import main
+    from polyline_codec import encode
+    from route_writer import StreamingRoutesWriter
+    traces = []
+    for i, path in enumerate(trace_paths):
+        segments = [segment[:, :2] for segment in quiet_segments(path)]
+        traces.append({
+            'id': i,
+            'polylines': [encode(main.segment_to_polyline(s)) for s in segments],
+            'lods': {
+                str(min_zoom): [encode(main.segment_to_polyline(s, tolerance)) for s in segments]
+                for min_zoom, tolerance in main.LOD_LEVELS
+            },
+        })
+    # Every other route also links the trace of the one before, so some traces are
+    # shared like in the real articles.
+    routes = [
+        {'name': 'Маршрут {0}'.format(i), 'link': synthetic.page_url(i),
+         'trace_ids': [i - 1, i] if i % 2 else [i]}
+        for i in range(len(traces))
+    ]
+    fd, path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        with timer.measure():
+            writer = StreamingRoutesWriter(path)
+            for route, trace in zip(routes, traces):
+                writer.add(route, [trace])
+            return writer.close()
+    finally:
+        os.unlink(path)
+
+
+def run_stage(stage, corpus_dir, routes, points, segments):
+    """Runs one stage in this process and returns its measurements."""
+    page_paths, trace_paths = synthetic.generate(corpus_dir, routes, points, segments)
+    timer = Timer()
+    output_bytes = globals()['stage_' + stage](page_paths, trace_paths, timer)
+    return {
+        'seconds': round(timer.seconds, 4),
+        # ru_maxrss is in kilobytes on Linux.
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+        'output_bytes': output_bytes,
+    }
+
+
+def run_stage_process(stage, args):
+    output = subprocess.check_output([
+        sys.executable, os.path.abspath(__file__), '--stage', stage, '--corpus', args.corpus,
+        '--routes', str(args.routes), '--points', str(args.points),
+        '--segments', str(args.segments),
+    ])
+    return simplejson.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def compare(results, baseline, threshold):
+    """Prints results next to baseline. Returns the stages that got slower than
+    threshold allows."""
+    regressions = []
+    print('{0:<22} {1:>10} {2:>10} {3:>14} {4:>10}'.format(
+        'stage', 'seconds', 'peak MB', 'output bytes', 'vs base'))
+    for stage, result in results.items():
+        change = ''
+        base = baseline.get(stage)
+        if base and base['seconds']:
+            ratio = result['seconds'] / base['seconds'] - 1
+            change = '{0:+.0%}'.format(ratio)
+            if ratio > threshold and result['seconds'] > MIN_SECONDS:
+                regressions.append(stage)
+                change += ' !'
+        print('{0:<22} {1:>10.3f} {2:>10.1f} {3:>14} {4:>10}'.format(
+            stage, result['seconds'], result['peak_rss_mb'], result['output_bytes'], change))
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline on a synthetic corpus.')
+    parser.add_argument('--preset', choices=sorted(PRESETS),
+                        help='Corpus size: small is 100 routes of 1000 points, medium 10k '
+                             'routes and large 100k routes of 100 points, 10M points total.')
+    parser.add_argument('--routes', type=int, default=100)
+    parser.add_argument('--points', type=int, default=1000, help='Points per trace.')
+    parser.add_argument('--segments', type=int, default=2, help='Segments per trace.')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--corpus', help='Where to generate the corpus.')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Save the results as the baseline for these corpus parameters.')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Relative slowdown against the baseline reported as a regression.')
+    parser.add_argument('--stage', choices=STAGES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.preset:
+        args.routes, args.points = PRESETS[args.preset]
+    if args.corpus is None:
+        args.corpus = os.path.join(bench_root, 'corpus', '{0}x{1}x{2}'.format(
+            args.routes, args.points, args.segments))
+    return args
+
+
+def main():
+    args = parse_args()
+    if args.stage:
+        print(simplejson.dumps(run_stage(args.stage, args.corpus, args.routes, args.points,
+                                         args.segments)))
+        return
+    print('Generating corpus in', args.corpus)
+    synthetic.generate(args.corpus, args.routes, args.points, args.segments)
+    results = {}
+    for stage in args.stages:
+        results[stage] = run_stage_process(stage, args)
+    baseline_path = os.path.join(bench_root, 'baselines', '{0}x{1}x{2}.json'.format(
+        args.routes, args.points, args.segments))
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = simplejson.loads(f.read())
+    regressions = compare(results, baseline, args.threshold)
+    if args.save_baseline:
+        if not os.path.exists(os.path.dirname(baseline_path)):
+            os.makedirs(os.path.dirname(baseline_path))
+        with open(baseline_path, 'w') as f:
+            f.write(simplejson.dumps(dict(baseline, **results), indent=4, sort_keys=True))
+        print('Saved baseline', baseline_path)
+    elif regressions:
+        sys.exit('Slower than the baseline: ' + ', '.join(regressions))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Synthetic mtb-bg.com articles and GPX traces, shaped like the real ones, for
+the benchmarks. The same parameters always produce the same corpus."""
+import io
+import os
+import random
+import zipfile
+
+import numpy as np
+
+PAGE_TEMPLATE = '''<html><head><title>{name}</title></head><body>
+<table class="contentpaneopen"><tr><td>
+<a href="/index.php/trails/gpstracks/{id}-route-{id}" class="contentpagetitle">{name}</a>
+</td></tr><tr><td><span class="createdate">{date}</span></td></tr><tr><td>
+{filler}
+<p><b>Изходна точка: </b>с. Бистрица, последна спирка на автобус {id}
+<b>Дължина:</b> {length} км / {length2} км с допълнителна обиколка
+<b>Денивелация:</b> (изкачване): {ascent} m
+<b>Продължителност:</b> 4-5 часа с по-бързо темпо, 6-7 часа с почивки
+<b>Вода:</b> {water} литра
+<b>Храна:</b> Не е необходима.
+<b>Терен:</b> - асфалт - 13 км - черни пътища Т3 -~20 км - пътеки т4 - 10,5 км
+<b>Ниво на техническа трудност:</b> високо (R1, R2, Т3, Т4, F)
+<b>Физическо натоварване:</b> Средно КФН={strenuousness}</p>
+<a href="/images/gpx/{id}.gpx">точки нарязани до 500 за стари гармини</a>
+<a href="/images/gpx/{id}.{trace_ext}">GPX следа</a>
+</td></tr></table></body></html>'''
+FILLER = '<p>Описание на маршрута, <a href="/index.php/about">връзка</a> и <span>текст</span>.</p>\n'
+WEEKDAYS = ['Понеделник', 'Вторник', 'Сряда', 'Четвъртък', 'Петък', 'Събота', 'Неделя']
+MONTHS = ['Януари', 'Февруари', 'Март', 'Април', 'Май', 'Юни', 'Юли', 'Август',
+          'Септември', 'Октомври', 'Ноември', 'Декември']
+GPX_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+              '<gpx version="1.1" creator="bench" xmlns="http://www.topografix.com/GPX/1/1">'
+              '<trk><name>{0}</name>\n')
+
+
+def page_url(route_id):
+    return 'http://mtb-bg.com/index.php/trails/gpstracks/{0}-route-{0}'.format(route_id)
+
+
+def trace_name(route_id):
+    # Every fifth trace is zipped, as on the site.
+    return '{0}.{1}'.format(route_id, 'zip' if route_id % 5 == 0 else 'gpx')
+
+
+def make_page(route_id, rng):
+    return PAGE_TEMPLATE.format(
+        id=route_id,
+        name='Маршрут {0}'.format(route_id),
+        date='{0}, {1} {2} {3} 11:00'.format(
+            WEEKDAYS[rng.randrange(7)], rng.randrange(1, 29), MONTHS[rng.randrange(12)],
+            rng.randrange(2008, 2016)),
+        filler=FILLER * rng.randrange(5, 30),
+        length='{0:.1f}'.format(rng.uniform(5, 90)),
+        length2='{0:.1f}'.format(rng.uniform(90, 120)),
+        ascent=rng.randrange(100, 2500),
+        water='{0:.1f}'.format(rng.uniform(0.5, 4)),
+        strenuousness=rng.randrange(1, 11),
+        trace_ext=trace_name(route_id).rsplit('.', 1)[1],
+    )
+
+
+def make_gpx(route_id, points, segments, np_rng):
+    """A random walk of the given number of points around Bulgaria, with
+    elevations, split into segments."""
+    start = np.array([np_rng.uniform(41.5, 44.0), np_rng.uniform(22.5, 28.0)])
+    coords = start + np.cumsum(np_rng.normal(0, 0.0001, (points, 2)), axis=0)
+    elevations = 500 + np.cumsum(np_rng.normal(0, 1.5, points))
+    out = io.StringIO()
+    out.write(GPX_HEADER.format(route_id))
+    for chunk in np.array_split(np.arange(points), segments):
+        out.write('<trkseg>\n')
+        for i in chunk:
+            out.write('<trkpt lat="{0:.7f}" lon="{1:.7f}"><ele>{2:.1f}</ele></trkpt>\n'.format(
+                coords[i, 0], coords[i, 1], elevations[i]))
+        out.write('</trkseg>\n')
+    out.write('</trk></gpx>\n')
+    return out.getvalue().encode('utf-8')
+
+
+def generate(corpus_dir, routes, points, segments=2, seed=1):
+    """Writes routes article pages to corpus_dir/pages and as many traces of
+    points points each to corpus_dir/traces, unless a corpus with the same
+    parameters is already there. Returns the (page paths, trace paths)."""
+    pages_dir = os.path.join(corpus_dir, 'pages')
+    traces_dir = os.path.join(corpus_dir, 'traces')
+    page_paths = [os.path.join(pages_dir, '{0}.html'.format(i)) for i in range(routes)]
+    trace_paths = [os.path.join(traces_dir, trace_name(i)) for i in range(routes)]
+    stamp_path = os.path.join(corpus_dir, 'complete')
+    stamp = '{0} {1} {2} {3}'.format(routes, points, segments, seed)
+    if os.path.exists(stamp_path):
+        with open(stamp_path) as f:
+            if f.read() == stamp:
+                return page_paths, trace_paths
+    for directory in (pages_dir, traces_dir):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+    rng = random.Random(seed)
+    np_rng = np.random.RandomState(seed)
+    for i in range(routes):
+        with io.open(page_paths[i], 'w', encoding='utf-8') as f:
+            f.write(make_page(i, rng))
+        gpx = make_gpx(i, points, segments, np_rng)
+        if trace_paths[i].endswith('.zip'):
+            with zipfile.ZipFile(trace_paths[i], 'w', zipfile.ZIP_DEFLATED) as z:
+                z.writestr('{0}.gpx'.format(i), gpx)
+        else:
+            with open(trace_paths[i], 'wb') as f:
+                f.write(gpx)
+    with open(stamp_path, 'w') as f:
+        f.write(stamp)
+    return page_paths, trace_paths
@@ -0,0 +1,182 @@
+from __future__ import unicode_literals, print_function
+
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlparse
+
+import requests
+import simplejson
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils import atomic_write, read_json
+
+
+class HostRateLimiter(object):
+    """Spaces out requests to the same host by at least 1 / rate seconds."""
+
+    def __init__(self, rate, host_rates=None):
+        self.rate = rate
+        self.host_rates = host_rates or {}
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    def wait(self, url):
+        host = urlparse(url).netloc
+        rate = self.host_rates.get(host, self.rate)
+        if not rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + 1.0 / rate
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def file_sha1(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class CacheMetadata(object):
+    """ETag, Last-Modified, size and content hash of the files in a cache
+    directory, stored as JSON inside that directory. Entries also record when
+    the content was last fetched, checked and changed, so later stages can
+    tell which inputs are new."""
+
+    FILENAME = '.meta.json'
+
+    def __init__(self, cache_dir):
+        self.path = os.path.join(cache_dir, self.FILENAME)
+        self.lock = threading.Lock()
+        self.entries = read_json(self.path) if os.path.exists(self.path) else {}
+        self.changed = set()
+
+    def get(self, name):
+        return self.entries.get(name, {})
+
+    def conditional_headers(self, name):
+        entry = self.get(name)
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def known_sha1(self, name, path):
+        sha1 = self.get(name).get('sha1')
+        if sha1 is None and os.path.exists(path):
+            sha1 = file_sha1(path)
+        return sha1
+
+    def mark_checked(self, name):
+        with self.lock:
+            self.entries.setdefault(name, {})['checked'] = datetime.utcnow().isoformat()
+
+    def record(self, name, headers, size, sha1, previous_sha1=None):
+        now = datetime.utcnow().isoformat()
+        with self.lock:
+            entry = self.entries.setdefault(name, {})
+            changed = previous_sha1 != sha1
+            entry.update({
+                'etag': headers.get('ETag'),
+                'last_modified': headers.get('Last-Modified'),
+                'size': size,
+                'sha1': sha1,
+                'fetched': now,
+                'checked': now,
+            })
+            if changed:
+                entry['changed'] = now
+                self.changed.add(name)
+        return changed
+
+    def save(self):
+        with self.lock:
+            atomic_write(self.path, simplejson.dumps(self.entries, indent='  ', sort_keys=True))
+
+
+def make_session(workers, retries=4, backoff_factor=0.5):
+    """A requests session pooling workers connections per host, retrying failed
+    and throttled requests with exponential backoff."""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=workers,
+        pool_maxsize=workers,
+        max_retries=Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+        ),
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class PageFetcher(object):
+    def __init__(self, workers=8, rate=4.0, host_rates=None, retries=4,
+                 backoff_factor=0.5, timeout=30, metadata=None):
+        self.workers = workers
+        self.metadata = metadata
+        self.timeout = timeout
+        self.limiter = HostRateLimiter(rate, host_rates)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes_fetched = 0
+        self.session = make_session(workers, retries, backoff_factor)
+
+    def get(self, url, **kwargs):
+        self.limiter.wait(url)
+        response = self.session.get(url, timeout=self.timeout, **kwargs)
+        response.raise_for_status()
+        with self.lock:
+            self.requests += 1
+            self.bytes_fetched += len(response.content)
+        return response
+
+    def fetch_to(self, url, dest, revalidate=False):
+        """Downloads url into dest. With revalidate, an existing dest is only
+        rewritten if the server does not answer 304 Not Modified. Returns whether
+        dest was written."""
+        name = os.path.basename(dest)
+        headers = {}
+        if revalidate and self.metadata is not None and os.path.exists(dest):
+            headers = self.metadata.conditional_headers(name)
+        response = self.get(url, headers=headers)
+        if response.status_code == 304:
+            if self.metadata is not None:
+                self.metadata.mark_checked(name)
+            return False
+        data = response.text.encode('utf-8')
+        if self.metadata is not None:
+            self.metadata.record(name, response.headers, len(data),
+                                 hashlib.sha1(data).hexdigest(),
+                                 self.metadata.known_sha1(name, dest))
+        atomic_write(dest, data)
+        return True
+
+    def fetch_all(self, jobs, revalidate=False):
+        """Downloads (url, dest) pairs concurrently. Returns a list of (url, error)
+        for the downloads that failed."""
+
+        def fetch(job):
+            url, dest = job
+            print('Revalidating' if revalidate else 'Downloading', url)
+            try:
+                self.fetch_to(url, dest, revalidate)
+            except requests.RequestException as e:
+                return url, e
+            return None
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return [r for r in executor.map(fetch, jobs) if r is not None]
@@ -0,0 +1,71 @@
+"""Rules for applying the differences found by compare_routes without asking.
+
+A policy is a JSON object like
+
+    {
+        "added": true,
+        "deleted": false,
+        "changed": {
+            "*": false,
+            "traces": true,
+            "length": {"max_change": 2, "max_relative_change": 0.1}
+        }
+    }
+
+"added" and "deleted" accept or reject new and deleted routes. "changed" maps a
+route key to a rule for changes of that key, "*" being the rule for keys not
+listed. A rule is true, false, or a dict of limits a numeric change has to stay
+within; changes to or from non-numbers never pass a limit rule.
+"""
+from __future__ import unicode_literals, print_function
+
+from decimal import Decimal
+from numbers import Number
+
+DEFAULT_POLICY = {
+    'added': True,
+    'deleted': False,
+    'changed': {'*': False},
+}
+
+
+def is_number(value):
+    return isinstance(value, Number) and not isinstance(value, bool)
+
+
+def check_limits(rule, old, new):
+    if not (is_number(old) and is_number(new)):
+        return False, 'not a numeric change'
+    change = abs(Decimal(new) - Decimal(old))
+    max_change = rule.get('max_change')
+    if max_change is not None and change > Decimal(str(max_change)):
+        return False, 'change {0} over {1}'.format(change, max_change)
+    max_relative_change = rule.get('max_relative_change')
+    if max_relative_change is not None:
+        if old == 0 or change / abs(Decimal(old)) > Decimal(str(max_relative_change)):
+            return False, 'relative change over {0}'.format(max_relative_change)
+    return True, 'within limits'
+
+
+def decide(policy, fix):
+    """Returns (accepted, reason) for fix under policy."""
+    if fix.kind in ('added', 'deleted'):
+        rule = policy.get(fix.kind, False)
+    else:
+        rules = policy.get('changed', {})
+        rule = rules.get(fix.key, rules.get('*', False))
+    if isinstance(rule, dict):
+        return check_limits(rule, fix.old, fix.new)
+    return bool(rule), 'accepted by policy' if rule else 'rejected by policy'
+
+
+def report_entry(fix, accepted, reason):
+    return {
+        'route': fix.route_name,
+        'kind': fix.kind,
+        'key': fix.key,
+        'old': fix.old,
+        'new': fix.new,
+        'accepted': accepted,
+        'reason': reason,
+    }
@@ -0,0 +1,139 @@
+"""Stage timings and counters for a pipeline run, written out as a JSON report.
+preprocessor imports this module too, through preprocessor/shared.py."""
+import contextlib
+import cProfile
+import heapq
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+
+import simplejson
+
+SLOWEST_ITEMS = 10
+
+
+class Stage(object):
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def add(self, bytes_in=0, bytes_out=0):
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+
+    def merge(self, data):
+        for attr in ('calls', 'wall', 'cpu', 'bytes_in', 'bytes_out'):
+            setattr(self, attr, getattr(self, attr) + data[attr])
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'wall': round(self.wall, 4),
+            'cpu': round(self.cpu, 4),
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+        }
+
+
+class RunReport(object):
+    """Collects per-stage wall and CPU time, bytes in and out, counters and the
+    slowest items of each kind. Reports from worker processes are sent back with
+    to_dict() and folded in with merge()."""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = datetime.utcnow().replace(microsecond=0).isoformat()
+        self.stages = {}
+        self.counters = {}
+        self.slowest = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Times the block as one call of the named stage, which is yielded to add
+        byte counts to. Nested stages are timed independently."""
+        stage = self.stages.setdefault(name, Stage())
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield stage
+        finally:
+            stage.calls += 1
+            stage.wall += time.perf_counter() - wall
+            stage.cpu += time.process_time() - cpu
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def item(self, kind, name, seconds):
+        """Records that handling one item, such as a page or a route, took seconds.
+        Only the SLOWEST_ITEMS slowest of each kind are kept."""
+        items = self.slowest.setdefault(kind, [])
+        entry = (round(seconds, 4), name)
+        if len(items) < SLOWEST_ITEMS:
+            heapq.heappush(items, entry)
+        else:
+            heapq.heappushpop(items, entry)
+
+    def merge(self, data):
+        for name, stage in data['stages'].items():
+            self.stages.setdefault(name, Stage()).merge(stage)
+        for name, n in data['counters'].items():
+            self.count(name, n)
+        for kind, items in data['slowest'].items():
+            for item in items:
+                self.item(kind, item['name'], item['seconds'])
+
+    def ratio(self, hits, misses):
+        """hits / (hits + misses) of two counters, or None without either."""
+        total = self.counters.get(hits, 0) + self.counters.get(misses, 0)
+        return round(self.counters.get(hits, 0) / float(total), 4) if total else None
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'started': self.started,
+            'python': platform.python_version(),
+            'argv': sys.argv,
+            'stages': {name: stage.to_dict() for name, stage in self.stages.items()},
+            'counters': dict(self.counters),
+            'hit_ratios': {
+                name[:-len('_hits')]: self.ratio(name, name[:-len('_hits')] + '_misses')
+                for name in self.counters if name.endswith('_hits')
+            },
+            'slowest': {
+                kind: [{'name': name, 'seconds': seconds}
+                       for seconds, name in sorted(items, reverse=True)]
+                for kind, items in self.slowest.items()
+            },
+        }
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            f.write(simplejson.dumps(self.to_dict(), indent=2, ensure_ascii=False))
+
+    def print_summary(self):
+        for name, stage in self.stages.items():
+            print('{0:<24} {1:>9.3f}s wall {2:>9.3f}s cpu {3:>6} calls'.format(
+                name, stage.wall, stage.cpu, stage.calls))
+
+
+@contextlib.contextmanager
+def profiled(path):
+    """Runs the block under cProfile and dumps the stats to path, for pstats or
+    snakeviz, if path is set. py-spy needs no hook: attach it to the process with
+    py-spy record --pid or run the script under it."""
+    if not path:
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
+        print('Wrote profile to', os.path.abspath(path))
@@ -0,0 +1,42 @@
+import unittest
+
+from instrument import SLOWEST_ITEMS, RunReport
+
+
+class RunReportTests(unittest.TestCase):
+    def test_stage(self):
+        report = RunReport('test')
+        for _ in range(2):
+            with report.stage('parse') as stage:
+                stage.add(bytes_in=10, bytes_out=3)
+        data = report.to_dict()['stages']['parse']
+        self.assertEqual((data['calls'], data['bytes_in'], data['bytes_out']), (2, 20, 6))
+        self.assertGreaterEqual(data['wall'], 0)
+
+    def test_slowest(self):
+        report = RunReport('test')
+        for i in range(SLOWEST_ITEMS * 2):
+            report.item('pages', 'page {0}'.format(i), i)
+        slowest = report.to_dict()['slowest']['pages']
+        self.assertEqual(len(slowest), SLOWEST_ITEMS)
+        self.assertEqual(slowest[0], {'name': 'page 19', 'seconds': 19})
+
+    def test_merge(self):
+        report = RunReport('main')
+        report.count('cache_hits', 3)
+        worker = RunReport('worker')
+        worker.count('cache_hits')
+        worker.count('cache_misses', 4)
+        worker.item('routes', 'slow', 5.0)
+        with worker.stage('extract'):
+            pass
+        report.merge(worker.to_dict())
+        data = report.to_dict()
+        self.assertEqual(data['counters'], {'cache_hits': 4, 'cache_misses': 4})
+        self.assertEqual(data['hit_ratios'], {'cache': 0.5})
+        self.assertEqual(data['stages']['extract']['calls'], 1)
+        self.assertEqual(data['slowest']['routes'], [{'name': 'slow', 'seconds': 5.0}])
+
+
+if __name__ == '__main__':
+    unittest.main()
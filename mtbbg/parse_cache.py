@@ -0,0 +1,53 @@
+from __future__ import unicode_literals, print_function
+
+import hashlib
+import os
+
+import simplejson
+
+from utils import atomic_write, read_json
+
+
+class ParseCache(object):
+    """parse_page results by page URL. An entry is used only while the page
+    content and parse options hash the same, and the whole cache is dropped
+    when the parser fingerprint changes."""
+
+    def __init__(self, path, fingerprint, enabled=True):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        if enabled and os.path.exists(path):
+            data = read_json(path)
+            if data.get('fingerprint') == fingerprint:
+                self.entries = data['pages']
+
+    @staticmethod
+    def key(content, *options):
+        sha1 = hashlib.sha1(content.encode('utf-8'))
+        sha1.update(repr(options).encode('utf-8'))
+        return sha1.hexdigest()
+
+    def get(self, url, key):
+        entry = self.entries.get(url)
+        if entry is None or entry['key'] != key:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry['route'], entry['warnings']
+
+    def put(self, url, key, result):
+        route, warnings = result
+        self.entries[url] = {
+            'key': key,
+            'route': route,
+            'warnings': warnings,
+        }
+
+    def save(self):
+        atomic_write(self.path, simplejson.dumps({
+            'fingerprint': self.fingerprint,
+            'pages': self.entries,
+        }, ensure_ascii=False))
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+
+import argparse
+import glob
+import io
+import os
+import sys
+import time
+
+from route_parser import exec_root, parse_page
+
+
+def parse_all(paths, parser):
+    results = {}
+    start = time.time()
+    for path in paths:
+        with io.open(path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        url = 'http://mtb-bg.com/index.php/trails/gpstracks/' + os.path.basename(path)[:-5]
+        try:
+            results[path] = parse_page(url, content, False, parser)
+        except Exception as e:
+            results[path] = repr(e)
+    return results, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare parse_page results of a fast parser with html5lib over html_cache.')
+    parser.add_argument('--parser', default='lxml', choices=['lxml', 'html.parser'])
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(exec_root, 'html_cache', '*.html')))
+    reference, reference_time = parse_all(paths, 'html5lib')
+    results, results_time = parse_all(paths, args.parser)
+    differences = 0
+    for path in paths:
+        if results[path] != reference[path]:
+            differences += 1
+            print('Difference in {0}:'.format(os.path.basename(path)))
+            print(' - html5lib:', reference[path])
+            print(' - {0}:'.format(args.parser), results[path])
+    print('{0} pages: html5lib took {1:.1f}s, {2} took {3:.1f}s, {4} differences'.format(
+        len(paths), reference_time, args.parser, results_time, differences))
+    return differences
+
+
+if __name__ == '__main__':
+    sys.exit(1 if main() else 0)
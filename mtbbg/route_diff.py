@@ -0,0 +1,126 @@
+from __future__ import unicode_literals, print_function
+
+import hashlib
+import re
+
+import simplejson
+
+from utils import ParseResultFix
+
+ARTICLE_ID_RE = re.compile(r'/gpstracks/(\d+)')
+
+
+def route_identity(route):
+    """What stays the same about a route when its article is edited: the article
+    id in its link, or the link itself, or failing both its name."""
+    link = route.get('link')
+    if link:
+        match = ARTICLE_ID_RE.search(link)
+        return 'article:' + match.group(1) if match else 'link:' + link
+    return 'name:' + route['name']
+
+
+def route_hash(route):
+    return hashlib.sha1(simplejson.dumps(route, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def index_routes(routes):
+    """Maps route_identity to route for a name -> route dict. Routes sharing an
+    identity with an earlier one are indexed by name instead."""
+    index = {}
+    for name, route in routes.items():
+        identity = route_identity(route)
+        if identity in index:
+            identity = 'name:' + name
+        index[identity] = route
+    return index
+
+
+# The action factories bind every value they need, so a fix can be applied at
+# any time after it was produced.
+
+def add_action(route):
+    def action(routes):
+        routes[route['name']] = route
+    return action
+
+
+def delete_action(route):
+    name = route['name']
+    identity = route_identity(route)
+
+    def action(routes):
+        # Another route may have been renamed to this name in the meantime.
+        if name in routes and route_identity(routes[name]) == identity:
+            del routes[name]
+    return action
+
+
+def set_action(name, key, value):
+    def action(routes):
+        routes[name][key] = value
+    return action
+
+
+def delete_key_action(name, key):
+    def action(routes):
+        del routes[name][key]
+    return action
+
+
+def rename_action(old_name, new_name):
+    def action(routes):
+        route = routes.pop(old_name)
+        route['name'] = new_name
+        routes[new_name] = route
+    return action
+
+
+def diff_route(old_route, new_route):
+    """Yields the fixes turning old_route into new_route, the rename last so the
+    others can still find the route under its old name."""
+    name = old_route['name']
+    keys = list(old_route) + [k for k in new_route if k not in old_route]
+    for key in keys:
+        if key == 'name':
+            continue
+        old_value = old_route.get(key)
+        new_value = new_route.get(key)
+        if old_value == new_value:
+            continue
+        if new_value is None:
+            action = delete_key_action(name, key)
+        else:
+            action = set_action(name, key, new_value)
+        yield ParseResultFix(
+            name, ' - {0}: {1} -> {2}'.format(key, old_value, new_value), action,
+            'changed', key, old_value, new_value)
+    if new_route['name'] != name:
+        yield ParseResultFix(
+            name, ' - name: {0} -> {1}'.format(name, new_route['name']),
+            rename_action(name, new_route['name']), 'changed', 'name', name, new_route['name'])
+
+
+def diff_routes(old_routes, new_routes, ignored_links=()):
+    """Yields the fixes turning old_routes into new_routes, both name -> route
+    dicts. Routes are matched by route_identity, and routes whose canonical form
+    hashes the same are skipped without comparing their fields. Deletions come
+    first, so that a route added or renamed to the name of a deleted one isn't
+    removed with it."""
+    old_index = index_routes(old_routes)
+    new_index = index_routes(new_routes)
+    for identity, old_route in old_index.items():
+        if identity in new_index or old_route.get('link') in ignored_links:
+            continue
+        yield ParseResultFix(old_route['name'], ' - Route deleted',
+                             delete_action(old_route), 'deleted', old=old_route)
+    for identity, new_route in new_index.items():
+        if new_route.get('link') in ignored_links:
+            continue
+        old_route = old_index.get(identity)
+        if old_route is None:
+            yield ParseResultFix(new_route['name'], ' - New route added',
+                                 add_action(new_route), 'added', new=new_route)
+        elif route_hash(old_route) != route_hash(new_route):
+            for fix in diff_route(old_route, new_route):
+                yield fix
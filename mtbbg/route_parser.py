@@ -1,18 +1,59 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 
+import argparse
 import copy
-import locale
+import hashlib
+import inspect
+import io
 import os
 import re
+import time
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from functools import lru_cache
 
-import requests
-from bs4 import BeautifulSoup
+import simplejson
+from bs4 import SoupStrainer
 from pytz import timezone
 
-from utils import parse_decimal, ParseResultFix, write_json, read_json, BS4_PARSER
+import fix_policy
+import route_diff
+import route_scanner
+from fetcher import CacheMetadata, PageFetcher
+from instrument import RunReport, profiled
+from parse_cache import ParseCache
+from route_store import INPUT_JSON_PATH, RouteStore, write_input_json
+from utils import (parse_decimal, read_json, make_soup, BS4_PARSER,
+                   atomic_write)
+
+
+LENGTH_RE = re.compile(r'^(?P<length>\d+([.,]\d+)?) ?(км|km)?$')
+NON_LETTERS_RE = re.compile(r'[^a-zа-я]')
+WATER_RE = re.compile(r'^(?P<water>\d+([.,]\d+)?) ?(л(итра)?)?.?$')
+ASCENT_RE = re.compile(
+    r'^(\((?P<direction>изкачване|спускане)\))? *[:–-]? *(?P<ascent>-?\d+([.,]\d+)?) ?(м|m)?$')
+STRENUOUSNESS_RE = re.compile(r'.*КФН=(?P<strenuousness>\d+).*')
+DIFFICULTY_RE = re.compile(r'(R1|R2|R3|T1|T2|T3|T4|T5|FX|F|X)')
+TERRAIN_RE = re.compile(r'(-|–)? ?(?P<terrain>(асфалт|черни пътища|пътеки)' +
+                        r'( (r1|r2|r3|t1|t2|t3|t4|t5|fx|f|x))?) ?' +
+                        r'(-|–)? ?~? ?(?P<length>\d+([.,]?\d+) ?)' +
+                        r' ?(км|km)?')
+SPACES_RE = re.compile(r'[ ]+')
+BG_WEEKDAYS = ['понеделник', 'вторник', 'сряда', 'четвъртък', 'петък', 'събота', 'неделя']
+BG_MONTHS = ['януари', 'февруари', 'март', 'април', 'май', 'юни', 'юли', 'август',
+             'септември', 'октомври', 'ноември', 'декември']
+BG_MONTH_NUMBERS = {name: i + 1 for i, name in enumerate(BG_MONTHS)}
+# Matches what strptime('%A, %d %B %Y %H:%M') matches under the bg_BG locale.
+DATE_RE = re.compile(
+    r'^\s*(?:{0})\s*,\s*(?P<day>\d{{1,2}})\s+(?P<month>{1})\s+(?P<year>\d{{4}})\s+'
+    r'(?P<hour>\d{{1,2}}):(?P<minute>\d{{2}})\s*$'.format('|'.join(BG_WEEKDAYS), '|'.join(BG_MONTHS)))
+SOFIA = timezone('Europe/Sofia')
+DIFFICULTY_SORT_ORDER = {
+    grade: i for i, grade in enumerate(
+        ['R1', 'R2', 'R3', 'T1', 'T2', 'T3', 'T4', 'T5', 'F', 'X', 'FX'])
+}
 
 
 def plaintext_parser(v):
@@ -22,14 +63,14 @@ def plaintext_parser(v):
 def length_parser(v):
     if '/' in v:
         v = v.split('/')[0].strip()
-    match = re.match('^(?P<length>\d+([.,]\d+)?) ?(км|km)?$', v)
+    match = LENGTH_RE.match(v)
     if match is None:
         return None
     return parse_decimal(match.group('length'))
 
 
 def unnecessary_false_parser(value):
-    s = re.sub('[^a-zа-я]', '', value.lower())
+    s = NON_LETTERS_RE.sub('', value.lower())
     if s in ['неенеобходима', 'няманужда']:
         return False
     return value
@@ -38,16 +79,14 @@ def unnecessary_false_parser(value):
 def water_parser(value):
     if unnecessary_false_parser(value) is False:
         return False
-    match = re.match('^(?P<water>\d+([.,]\d+)?) ?(л(итра)?)?.?$', value)
+    match = WATER_RE.match(value)
     if match is None:
         return value
     return parse_decimal(match.group('water'))
 
 
 def ascent_parser(v):
-    match = re.match(
-        '^(\((?P<direction>изкачване|спускане)\))? *[:–-]? *(?P<ascent>-?\d+([.,]\d+)?) ?(м|m)?$',
-        v)
+    match = ASCENT_RE.match(v)
     if match is None:
         return None
     result = parse_decimal(match.group('ascent'))
@@ -58,7 +97,7 @@ def ascent_parser(v):
 
 
 def strenuousness_parser(v):
-    match = re.match('.*КФН=(?P<strenuousness>\d+).*', v)
+    match = STRENUOUSNESS_RE.match(v)
     if match is None:
         return None
     return int(match.group('strenuousness'))
@@ -67,29 +106,22 @@ def strenuousness_parser(v):
 def difficulty_parser(v):
     # Replace cyrillic T with latin T, because R is already latin.
     v = v.replace('Т', 'T')
-    return sorted(set(re.findall('(R1|R2|R3|T1|T2|T3|T4|T5|FX|F|X)', v)),
-                  key=lambda x: difficulty_parser.sort_order.index(x))
+    return sorted(set(DIFFICULTY_RE.findall(v)), key=DIFFICULTY_SORT_ORDER.__getitem__)
 
 
 def terrain_parser(v):
     v = v.lower().replace('т1', 't1').replace('т2', 't2').replace(
         'т3', 't3').replace('т4', 't4').replace('т5', 't5')
-    matches = re.finditer('(-|–)? ?(?P<terrain>(асфалт|черни пътища|пътеки)' +
-                          '( (r1|r2|r3|t1|t2|t3|t4|t5|fx|f|x))?) ?' +
-                          '(-|–)? ?~? ?(?P<length>\d+([.,]?\d+) ?)' +
-                          ' ?(км|km)?', v)
     result = [
         {
             'terrain': m.group('terrain'),
             'length': parse_decimal(m.group('length')),
         }
-        for m in matches
+        for m in TERRAIN_RE.finditer(v)
     ]
     return result or None
 
 
-difficulty_parser.sort_order = ['R1', 'R2', 'R3', 'T1', 'T2', 'T3', 'T4', 'T5', 'F', 'X', 'FX']
-
 keys = {
     'изходна точка': 'trailhead',
     'дължина': 'length',
@@ -115,19 +147,42 @@ parsers = {
 }
 exec_root = os.path.dirname(__file__)
 
+# Every element parse_page looks at is one of these. Anything else is skipped
+# while parsing, with parsers that support it.
+PAGE_ELEMENTS = ['a', 'p', 'span']
+PAGE_STRAINER = SoupStrainer(PAGE_ELEMENTS)
+
+
+def page_cache_path(url):
+    return os.path.join(exec_root, 'html_cache', os.path.basename(url) + '.html')
+
 
-def download_page(url):
-    dest = os.path.join(exec_root, 'html_cache',
-                        os.path.basename(url) + '.html')
-    if os.path.exists(dest):
-        with open(dest, 'r') as f:
-            return f.read()
-    print('Downloading', url)
-    with open(dest, 'w') as f:
-        page = requests.get(url)
-        page.raise_for_status()
-        f.write(page.text)
-    return download_page(url)
+def download_page(url, fetcher=None):
+    dest = page_cache_path(url)
+    if not os.path.exists(dest):
+        print('Downloading', url)
+        (fetcher or PageFetcher(workers=1)).fetch_to(url, dest)
+    with io.open(dest, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def prefetch_pages(urls, fetcher, revalidate=False):
+    jobs = [(url, page_cache_path(url)) for url in urls
+            if revalidate or not os.path.exists(page_cache_path(url))]
+    if not jobs:
+        return
+    print('Fetching {0} pages with {1} workers'.format(len(jobs), fetcher.workers))
+    try:
+        failures = fetcher.fetch_all(jobs, revalidate)
+    finally:
+        if fetcher.metadata is not None:
+            fetcher.metadata.save()
+    for url, error in failures:
+        print('Failed to download {0}: {1}'.format(url, error))
+    if failures:
+        raise Exception('Failed to download {0} pages'.format(len(failures)))
+    if fetcher.metadata is not None:
+        print('{0} pages changed'.format(len(fetcher.metadata.changed)))
 
 
 def split_meta_strings(strings):
@@ -159,10 +214,30 @@ def parse_meta_parts(meta_parts):
     return parsed_meta, warnings
 
 
-def find_metas(soup):
+def parse_meta_parts_batch(meta_parts_list):
+    """parse_meta_parts for many meta_parts dicts at once."""
+    return [parse_meta_parts(meta_parts) for meta_parts in meta_parts_list]
+
+
+def collect_page_elements(soup):
+    """Collects the PAGE_ELEMENTS of a page by tag name, in document order, in a
+    single pass over the tree."""
+    elements = {name: [] for name in PAGE_ELEMENTS}
+    for tag in soup.find_all(PAGE_ELEMENTS):
+        elements[tag.name].append(tag)
+    return elements
+
+
+def has_class(tag, class_name):
+    return class_name in (tag.get('class') or [])
+
+
+def find_metas(soup, elements=None):
+    if elements is None:
+        elements = collect_page_elements(soup)
     metas = []
-    for p in soup.find_all('p'):
-        strings = list(re.sub('[ ]+', ' ', t) for t in p.stripped_strings)
+    for p in elements['p']:
+        strings = list(SPACES_RE.sub(' ', t) for t in p.stripped_strings)
         if 'Изходна точка:' in strings or 'Дължина:' in strings or 'Продължителност:' in strings:
             meta_parts = split_meta_strings(strings)
             parse_results = parse_meta_parts(meta_parts)
@@ -170,9 +245,11 @@ def find_metas(soup):
     return metas
 
 
-def find_trace_links(soup):
+def find_trace_links(soup, elements=None):
+    if elements is None:
+        elements = collect_page_elements(soup)
     links = []
-    for a in soup.find_all('a'):
+    for a in elements['a']:
         href = a.get('href')
         if not href:
             continue
@@ -184,9 +261,13 @@ def find_trace_links(soup):
     return links
 
 
-def find_name(soup):
+def find_name(soup, elements=None):
+    if elements is None:
+        elements = collect_page_elements(soup)
     result = None
-    for title in soup.find_all('a', attrs={'class': 'contentpagetitle'}):
+    for title in elements['a']:
+        if not has_class(title, 'contentpagetitle'):
+            continue
         if result is None:
             result = title.get_text(strip=True)
         else:
@@ -194,37 +275,49 @@ def find_name(soup):
     return result
 
 
+@lru_cache(maxsize=None)
 def parse_date(value):
-    locale.setlocale(locale.LC_TIME, 'bg_BG.UTF-8')
-    date_str = value.lower()
-    return datetime.strptime(date_str, '%A, %d %B %Y %H:%M')
+    """Parses an article date such as 'Вторник, 22 Януари 2008 11:00' into a naive
+    datetime in Sofia time. Doesn't depend on the process locale, so it's safe to
+    call from any thread."""
+    match = DATE_RE.match(value.lower())
+    if match is None:
+        raise ValueError('Unrecognised date: {0}'.format(value))
+    return datetime(int(match.group('year')), BG_MONTH_NUMBERS[match.group('month')],
+                    int(match.group('day')), int(match.group('hour')), int(match.group('minute')))
 
 
-def find_date(soup):
+def find_date(soup, elements=None):
+    if elements is None:
+        elements = collect_page_elements(soup)
     article_date = None
-    for date_elem in soup.find_all('span', attrs={'class': 'createdate'}):
+    for date_elem in elements['span']:
+        if not has_class(date_elem, 'createdate'):
+            continue
         if article_date is not None:
             return None
         article_date = parse_date(date_elem.get_text(strip=True))
-    article_date.replace(tzinfo=timezone('Europe/Sofia'))
-    return article_date.isoformat()
+    if article_date is None:
+        return None
+    return SOFIA.localize(article_date).isoformat()
 
 
-def parse_page(url, content, ignore_errors):
+def parse_page(url, content, ignore_errors, parser=None):
     if len(content) == 0:
         raise Exception('Empty HTML file: {}!'.format(url))
-    soup = BeautifulSoup(content, BS4_PARSER)
+    soup = make_soup(content, PAGE_STRAINER, parser)
+    elements = collect_page_elements(soup)
     route = {
-        'name': find_name(soup),
-        'date': find_date(soup),
+        'name': find_name(soup, elements),
+        'date': find_date(soup, elements),
         'link': url,
     }
     if route['name'] is None:
         return None, ['Error parsing {0}: name not found.'.format(url)]
     if route['date'] is None:
         return None, ['Error parsing {0}: date not found.'.format(url)]
-    parse_results = find_metas(soup)
-    trace_links = find_trace_links(soup)
+    parse_results = find_metas(soup, elements)
+    trace_links = find_trace_links(soup, elements)
     parse_warnings = [warning for result in parse_results for warning in result[1]]
     if len(trace_links) == 0:
         parse_warnings.append(
@@ -241,103 +334,252 @@ def parse_page(url, content, ignore_errors):
     return route, parse_warnings
 
 
+def parse_page_job(job):
+    url, ignore_errors, parser = job
+    return parse_page(url, download_page(url), ignore_errors, parser)
+
+
+def timed_parse_page_job(job):
+    start = time.perf_counter()
+    result = parse_page_job(job)
+    return result, time.perf_counter() - start
+
+
+def parse_pages(jobs, workers, report=None):
+    """Runs parse_page over (url, ignore_errors, parser) jobs for cached pages and
+    returns their (route, warnings) in input order. The time each page took is
+    recorded in report."""
+    if workers <= 1:
+        timed = list(map(timed_parse_page_job, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            timed = list(executor.map(timed_parse_page_job, jobs, chunksize=8))
+    if report is not None:
+        for (url, _, _), (_, seconds) in zip(jobs, timed):
+            report.item('pages', url, seconds)
+    return [result for result, _ in timed]
+
+
+def parser_fingerprint():
+    """A hash of everything that decides parse_page's output for a given page:
+    the keys and parsers tables, the source of the parsing functions and the
+    regexes they use. Changing any of them invalidates the ParseCache."""
+    sha1 = hashlib.sha1(repr(sorted(keys.items())).encode('utf-8'))
+    functions = [parsers[k] for k in sorted(parsers)] + [
+        split_meta_strings, parse_meta_parts, collect_page_elements, has_class, find_metas,
+        find_trace_links, find_name, parse_date, find_date, parse_page,
+    ]
+    for function in functions:
+        sha1.update(inspect.getsource(function).encode('utf-8'))
+    for name, value in sorted(globals().items()):
+        if isinstance(value, type(LENGTH_RE)):
+            sha1.update('{0}={1}'.format(name, value.pattern).encode('utf-8'))
+    sha1.update(repr(PAGE_ELEMENTS).encode('utf-8'))
+    return sha1.hexdigest()
+
+
+def parse_pages_cached(jobs, workers, cache, report=None):
+    """parse_pages, reusing the results in cache for pages that haven't changed
+    and storing the new ones."""
+    report = report or RunReport('route_parser')
+    results = [None] * len(jobs)
+    pending = []
+    with report.stage('parse_cache_lookup') as stage:
+        for i, (url, ignore_errors, parser) in enumerate(jobs):
+            content = download_page(url)
+            stage.add(bytes_in=len(content.encode('utf-8')))
+            key = cache.key(content, ignore_errors, parser or BS4_PARSER)
+            results[i] = cache.get(url, key)
+            if results[i] is None:
+                pending.append((i, key))
+    report.count('parse_cache_hits', cache.hits)
+    report.count('parse_cache_misses', cache.misses)
+    if pending:
+        print('Parsing {0} changed pages'.format(len(pending)))
+    with report.stage('parse'):
+        parsed = parse_pages([jobs[i] for i, _ in pending], workers, report)
+    for (i, key), result in zip(pending, parsed):
+        cache.put(jobs[i][0], key, result)
+        results[i] = result
+    with report.stage('parse_cache_save'):
+        cache.save()
+    return results
+
+
 def read_routes():
-    input_routes = read_json(os.path.join(exec_root, '..', 'preprocessor', 'input.json'))
+    input_routes = read_json(INPUT_JSON_PATH)
     if len(set(r['name'] for r in input_routes['routes'])) != len(input_routes['routes']):
         print('Duplicate route names in input.json. Can\'t process.')
     return {r['name']: r for r in input_routes['routes']}
 
 
 def write_routes(routes):
-    route_list = list(routes.values())
-    route_list.sort(key=lambda r: (r['date'], r['name']))
-    data = {
-        'routes': route_list,
-    }
-    write_json(os.path.join(exec_root, '..', 'preprocessor', 'input.json'), data, {
-        'indent': '  ',
-        'item_sort_key': lambda i: [
-            'name', 'date', 'link', 'terrain', 'length', 'ascent',
-            'difficulty', 'strenuousness', 'duration', 'water', 'food',
-            'terrains', 'traces', 'routes', 'trailhead'].index(i[0]),
-        'ensure_ascii': False,
-    })
+    write_input_json(INPUT_JSON_PATH, routes)
 
 
 def compare_routes(old_routes, new_routes, exceptions):
     ignored_links = set(k for k, v in exceptions.items() if v == 'ignore')
-    old_names = set(old_routes.keys())
-    new_names = set(new_routes.keys())
-    for name in new_names - old_names:
-        if new_routes[name]['link'] in ignored_links:
-            continue
+    return route_diff.diff_routes(old_routes, new_routes, ignored_links)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Parse mtb-bg.com route pages into input.json.')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='Number of concurrent page downloads.')
+    parser.add_argument('--rate', type=float, default=4.0,
+                        help='Maximum requests per second to a single host.')
+    parser.add_argument('--revalidate', action='store_true',
+                        help='Send conditional requests for cached pages and '
+                             'rewrite only the ones that changed.')
+    parser.add_argument('--parser', choices=['html5lib', 'lxml', 'html.parser'],
+                        help='BeautifulSoup parser for pages, overriding MTBBG_BS4_PARSER.')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='Number of worker processes for page parsing.')
+    parser.add_argument('--reparse', action='store_true',
+                        help='Ignore cached parse results and parse every page again.')
+    parser.add_argument('--delta', action='store_true',
+                        help='Only fetch and parse the pages route_scanner found new since '
+                             'the last --delta run, and only compare those and the removed '
+                             'ones against input.json.')
+    parser.add_argument('--store', metavar='PATH',
+                        help='Read and update routes in this SQLite store (see route_store.py) '
+                             'instead of rewriting input.json on every change.')
+    parser.add_argument('--run-report', metavar='PATH',
+                        help='Write stage timings, counters and the slowest pages to this '
+                             'JSON file.')
+    parser.add_argument('--profile', metavar='PATH',
+                        help='Run under cProfile and write the stats to this file.')
+    parser.add_argument('--batch', metavar='POLICY', nargs='?', const='',
+                        help='Apply the differences accepted by the policy JSON file without '
+                             'asking and write input.json once. Without a file, new routes '
+                             'are added and nothing else is changed.')
+    parser.add_argument('--report', metavar='PATH',
+                        help='With --batch, write every difference and whether it was applied '
+                             'to this JSON file.')
+    args = parser.parse_args()
+    if args.store and not os.path.exists(args.store):
+        parser.error('no route store at {0}'.format(args.store))
+    return args
+
+
+def apply_batch(fixes, routes, policy, on_apply=None):
+    """Applies the fixes accepted by policy to routes, calling on_apply(fix) after
+    each. Returns a report entry for every fix."""
+    report = []
+    for fix in fixes:
+        accepted, reason = fix_policy.decide(policy, fix)
+        if accepted:
+            fix.apply(routes)
+            if on_apply is not None:
+                on_apply(fix)
+        report.append(fix_policy.report_entry(fix, accepted, reason))
+    return report
 
-        def action(routes):
-            routes[name] = new_routes[name]
 
-        yield ParseResultFix(name, ' - New route added', action)
-    for name in old_names - new_names:
-        if old_routes[name]['link'] in ignored_links:
-            continue
-
-        def action(routes):
-            del routes[name]
-
-        yield ParseResultFix(name, ' - Route deleted', action)
-    for name in old_names & new_names:
-        if new_routes[name]['link'] in ignored_links:
-            continue
-
-        old_route = old_routes[name]
-        new_route = new_routes[name]
-        old_route_keys = set(old_route.keys())
-        new_route_keys = set(new_route.keys())
-        for key in old_route_keys | new_route_keys:
-            old_value = old_route.get(key)
-            new_value = new_route.get(key)
-            if old_value != new_value:
-                if new_value is None:
-                    def action(routes):
-                        del routes[name][key]
-                else:
-                    def action(routes):
-                        routes[name][key] = new_value
-                yield ParseResultFix(
-                    name, ' - {0}: {1} -> {2}'.format(key, old_value, new_value), action)
+def main():
+    args = parse_args()
+    report = RunReport('route_parser')
+    with profiled(args.profile):
+        run(args, report)
+    report.print_summary()
+    if args.run_report:
+        report.write(args.run_report)
 
 
-def main():
+def run(args, report):
     pages_exceptions = {}
     online_routes = {}
-    saved_routes = read_routes()
+    store = RouteStore(args.store) if args.store else None
+    saved_routes = store.routes() if store else read_routes()
     fixed_routes = copy.deepcopy(saved_routes)
 
     with open(os.path.join(exec_root, 'pages_exceptions.txt')) as f:
         for line in f:
             parts = line.strip().split(': ', 2)
             pages_exceptions[parts[2]] = parts[1]
-    with open(os.path.join(exec_root, 'pages.txt')) as f:
-        for rel_url in f:
-            rel_url = rel_url.strip()
-            exception = pages_exceptions.get(rel_url)
-            if exception == 'ignore':
-                continue
-            url = u'http://mtb-bg.com' + rel_url.strip()
-            content = download_page(url)
-            route, warnings = parse_page(url, content, exception == 'include')
-            if exception != 'include' and warnings:
-                print('On route {0}:'.format(url))
-                for warning in warnings:
-                    print(' -', warning)
-            if route is not None:
-                online_routes[route['name']] = route
+    if args.delta:
+        delta = route_scanner.read_delta()
+        rel_urls = delta['added']
+        removed_links = set('http://mtb-bg.com' + rel_url for rel_url in delta['removed'])
+    else:
+        with open(os.path.join(exec_root, 'pages.txt')) as f:
+            rel_urls = [rel_url.strip() for rel_url in f]
+    pages = []
+    for rel_url in rel_urls:
+        exception = pages_exceptions.get(rel_url)
+        if exception == 'ignore':
+            continue
+        pages.append((u'http://mtb-bg.com' + rel_url, exception))
+    metadata = CacheMetadata(os.path.join(exec_root, 'html_cache'))
+    fetcher = PageFetcher(workers=args.workers, rate=args.rate, metadata=metadata)
+    with report.stage('prefetch') as stage:
+        prefetch_pages([url for url, _ in pages], fetcher, args.revalidate)
+        stage.add(bytes_in=fetcher.bytes_fetched)
+    report.count('pages', len(pages))
+    report.count('page_requests', fetcher.requests)
+    report.count('pages_changed', len(metadata.changed))
+    jobs = [(url, exception == 'include', args.parser) for url, exception in pages]
+    cache = ParseCache(os.path.join(exec_root, 'parse_cache.json'), parser_fingerprint(),
+                       enabled=not args.reparse)
+    results = parse_pages_cached(jobs, args.jobs, cache, report)
+    print('Parsed {0} pages, {1} unchanged'.format(len(jobs), cache.hits))
+    for (url, exception), (route, warnings) in zip(pages, results):
+        report.count('parse_warnings', len(warnings))
+        if exception != 'include' and warnings:
+            print('On route {0}:'.format(url))
+            for warning in warnings:
+                print(' -', warning)
+        if route is not None:
+            online_routes[route['name']] = route
+    if store:
+        parsed = datetime.utcnow().isoformat()
+        store.record_pages([
+            (url, metadata.get(os.path.basename(page_cache_path(url))), parsed, warnings)
+            for (url, _), (_, warnings) in zip(pages, results)
+        ])
+    if args.delta:
+        # Leave the routes of pages that weren't rescanned out of the comparison,
+        # or they would all show up as deleted.
+        links = removed_links | set(url for url, _ in pages)
+        saved_routes = {
+            name: route for name, route in saved_routes.items()
+            if route['link'] in links or name in online_routes
+        }
+    with report.stage('compare'):
+        fixes = list(compare_routes(saved_routes, online_routes, pages_exceptions))
+    report.count('differences', len(fixes))
+    if args.batch is not None:
+        policy = read_json(args.batch) if args.batch else fix_policy.DEFAULT_POLICY
+        with report.stage('apply'):
+            if store:
+                entries = apply_batch(fixes, fixed_routes, policy,
+                                      lambda fix: store.apply_fix(fix, fixed_routes))
+            else:
+                entries = apply_batch(fixes, fixed_routes, policy)
+            applied = sum(1 for entry in entries if entry['accepted'])
+            if applied and not store:
+                write_routes(fixed_routes)
+        report.count('differences_applied', applied)
+        if args.report:
+            atomic_write(args.report, simplejson.dumps(
+                {'applied': applied, 'rejected': len(entries) - applied, 'fixes': entries},
+                indent=2, ensure_ascii=False))
+        print('Applied {0} of {1} differences'.format(applied, len(entries)))
+        if args.delta:
+            route_scanner.consume_delta(delta)
+        return
     last_header = None
-    for fix in compare_routes(saved_routes, online_routes, pages_exceptions):
+    for fix in fixes:
         if fix.route_name != last_header:
             print('On route', fix.route_name)
             last_header = fix.route_name
         if fix.interact_apply(fixed_routes):
-            write_routes(fixed_routes)
+            if store:
+                store.apply_fix(fix, fixed_routes)
+            else:
+                write_routes(fixed_routes)
+    if args.delta:
+        route_scanner.consume_delta(delta)
 
 
 if __name__ == '__main__':
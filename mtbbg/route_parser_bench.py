@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+
+import timeit
+
+import route_parser
+
+SAMPLE_META_PARTS = {
+    'trailhead': 'с. Бистрица, последна спирка на автобус 69',
+    'length': '43.4 км / 48.3 км с допълнителна обиколка около вр. Свети Илия',
+    'ascent': '(изкачване): 1240 m',
+    'duration': '4-5 часа с по-бързо темпо, 6-7 часа с почивки',
+    'water': '3.3 литра',
+    'food': 'Не е необходима.',
+    'terrains': '- асфалт - 13 км - черни пътища Т3 -~20 км - пътеки т4 - 10,5 км',
+    'difficulty': 'високо (R1, R2, Т3, Т4, Т5, F, X)',
+    'strenuousness': 'Средно КФН=6',
+}
+
+
+def bench(name, stmt, number):
+    seconds = min(timeit.repeat(stmt, number=number, repeat=5))
+    print('{0:<32} {1:>10.2f} us/call'.format(name, seconds / number * 1e6))
+
+
+def main():
+    for key, value in sorted(SAMPLE_META_PARTS.items()):
+        parser = route_parser.parsers[key]
+        bench(parser.__name__, lambda: parser(value), 20000)
+    bench('parse_meta_parts', lambda: route_parser.parse_meta_parts(SAMPLE_META_PARTS), 5000)
+    batch = [SAMPLE_META_PARTS] * 1000
+    seconds = min(timeit.repeat(lambda: route_parser.parse_meta_parts_batch(batch),
+                                number=1, repeat=5))
+    print('{0:<32} {1:>10.2f} ms/1000 routes'.format('parse_meta_parts_batch', seconds * 1e3))
+
+
+if __name__ == '__main__':
+    main()
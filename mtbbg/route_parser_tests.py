@@ -1,11 +1,19 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
+from datetime import datetime
 from decimal import Decimal
+import copy
+import os
+import shutil
+import tempfile
 import unittest
 from bs4 import BeautifulSoup
 
+import fix_policy
+import route_diff
 import route_parser
-from utils import BS4_PARSER
+from parse_cache import ParseCache
+from utils import BS4_PARSER, ParseResultFix, make_soup
 
 
 class ParserTests(unittest.TestCase):
@@ -96,6 +104,15 @@ class MetaTests(unittest.TestCase):
         })
         self.assertEqual(len(parse_results[1]), 2)
 
+    def test_parse_meta_parts_batch(self):
+        self.assertEqual(route_parser.parse_meta_parts_batch([
+            {'length': '35 км'},
+            {'length': 'км', 'water': '3 л'},
+        ]), [
+            ({'length': Decimal('35')}, []),
+            ({'water': Decimal('3')}, ['Parser for length failed on км returning None']),
+        ])
+
     def test_find_metas(self):
         soup = BeautifulSoup(
             '<p><b>Изходна точка: </b>Перперикон <b>Дължина</b> 13km</p>',
@@ -115,6 +132,39 @@ class MetaTests(unittest.TestCase):
         )
         self.assertEqual(route_parser.find_trace_links(soup), ['http://mtb-bg.com/test.gpx'])
 
+    def test_restricted_lxml_finds_same_elements(self):
+        content = (
+            '<html><body><table><tr><td>' +
+            '<a class="contentpagetitle">Заглавие</a>' +
+            '<div><p><b>Изходна точка: </b>Перперикон <b>Дължина</b> 13km' +
+            '<p>Текст <a href="/test.gpx">GPX следа</a></div>' +
+            '</td></tr></table></body></html>')
+        reference = BeautifulSoup(content, 'html5lib')
+        soup = make_soup(content, route_parser.PAGE_STRAINER, 'lxml')
+        elements = route_parser.collect_page_elements(soup)
+        self.assertEqual(route_parser.find_name(soup, elements),
+                         route_parser.find_name(reference))
+        self.assertEqual(route_parser.find_metas(soup, elements),
+                         route_parser.find_metas(reference))
+        self.assertEqual(route_parser.find_trace_links(soup, elements),
+                         route_parser.find_trace_links(reference))
+
+    def test_parse_date(self):
+        self.assertEqual(route_parser.parse_date('Вторник, 22 Януари 2008 11:00'),
+                         datetime(2008, 1, 22, 11, 0))
+        self.assertEqual(route_parser.parse_date('неделя, 1 юли 2012 09:05'),
+                         datetime(2012, 7, 1, 9, 5))
+        with self.assertRaises(ValueError):
+            route_parser.parse_date('22.01.2008 11:00')
+
+    def test_find_date(self):
+        soup = BeautifulSoup(
+            '<span class="createdate">Неделя, 01 Юли 2012 09:05</span>',
+            BS4_PARSER,
+        )
+        self.assertEqual(route_parser.find_date(soup), '2012-07-01T09:05:00+03:00')
+        self.assertEqual(route_parser.find_date(BeautifulSoup('', BS4_PARSER)), None)
+
     def test_parse_empty_page(self):
         with self.assertRaises(Exception):
             route_parser.parse_page('demo', '', False)
@@ -130,18 +180,152 @@ class MetaTests(unittest.TestCase):
     def test_parse_page(self):
         content = (
                 '<a class="contentpagetitle"> Заглавие </a>' +
+                '<span class="createdate">Сряда, 22 Януари 2014 18:30</span>' +
                 '<p><b>Изходна точка: </b>Перперикон <b>Дължина</b> 13km</p>' +
                 '<a href="/test.bin">hello world</a>' +
                 '<a href="/test.gpx">точки нарязани до 500 за стари гармини</a>' +
                 '<a href="/test.gpx">GPX следа</a>')
         parse_results = route_parser.parse_page('demo', content, False)
-        self.assertEqual(parse_results[0], {
+        self.assertEqual(parse_results, ({
             'name': 'Заглавие',
+            'date': '2014-01-22T18:30:00+02:00',
             'trailhead': 'Перперикон',
             'length': Decimal(13),
             'link': 'demo',
             'traces': ['http://mtb-bg.com/test.gpx']
+        }, []))
+
+
+class BatchTests(unittest.TestCase):
+    policy = {
+        'added': True,
+        'deleted': False,
+        'changed': {
+            '*': False,
+            'traces': True,
+            'length': {'max_change': 2, 'max_relative_change': 0.1},
+        },
+    }
+
+    def test_apply_batch(self):
+        old = {
+            'A': {'name': 'A', 'link': 'a', 'length': Decimal(30), 'traces': ['x']},
+            'B': {'name': 'B', 'link': 'b', 'length': Decimal(10), 'water': '1 л'},
+            'C': {'name': 'C', 'link': 'c'},
+        }
+        new = {
+            'A': {'name': 'A', 'link': 'a', 'length': Decimal('31.5'), 'traces': ['y']},
+            'B': {'name': 'B', 'link': 'b', 'length': Decimal(12), 'water': False},
+            'D': {'name': 'D', 'link': 'd'},
+        }
+        routes = copy.deepcopy(old)
+        report = route_parser.apply_batch(
+            route_parser.compare_routes(old, new, {}), routes, self.policy)
+        self.assertEqual(routes, {
+            'A': {'name': 'A', 'link': 'a', 'length': Decimal('31.5'), 'traces': ['y']},
+            'B': {'name': 'B', 'link': 'b', 'length': Decimal(10), 'water': '1 л'},
+            'C': {'name': 'C', 'link': 'c'},
+            'D': {'name': 'D', 'link': 'd'},
         })
+        accepted = sorted((e['route'], e['kind'], e['key']) for e in report if e['accepted'])
+        self.assertEqual(accepted, [
+            ('A', 'changed', 'length'), ('A', 'changed', 'traces'), ('D', 'added', None),
+        ])
+        self.assertEqual(len(report), 6)
+
+    def test_limits_need_numbers(self):
+        fix = ParseResultFix('A', '', None, 'changed', 'length', None, Decimal(3))
+        self.assertEqual(fix_policy.decide(self.policy, fix), (False, 'not a numeric change'))
+
+
+class RouteDiffTests(unittest.TestCase):
+    def test_route_identity(self):
+        self.assertEqual(route_diff.route_identity(
+            {'name': 'A', 'link': 'http://mtb-bg.com/index.php/trails/gpstracks/1021-atoluka'}),
+            'article:1021')
+        self.assertEqual(route_diff.route_identity({'name': 'A', 'link': 'demo'}), 'link:demo')
+        self.assertEqual(route_diff.route_identity({'name': 'A'}), 'name:A')
+
+    def test_fixes_apply_later(self):
+        old = {
+            'Old': {'name': 'Old', 'link': '/gpstracks/1-a', 'length': Decimal(3), 'food': 'x'},
+            'Same': {'name': 'Same', 'link': '/gpstracks/2-b'},
+            'Gone': {'name': 'Gone', 'link': '/gpstracks/3-c'},
+        }
+        new = {
+            'New': {'name': 'New', 'link': '/gpstracks/1-a-renamed', 'length': Decimal(4),
+                    'water': False},
+            'Same': {'name': 'Same', 'link': '/gpstracks/2-b'},
+            'Added': {'name': 'Added', 'link': '/gpstracks/4-d'},
+        }
+        fixes = list(route_diff.diff_routes(old, new))
+        self.assertEqual([(f.kind, f.key) for f in fixes if f.route_name == 'Old'], [
+            ('changed', 'link'), ('changed', 'length'), ('changed', 'food'),
+            ('changed', 'water'), ('changed', 'name'),
+        ])
+        self.assertEqual(len(fixes), 7)
+        routes = copy.deepcopy(old)
+        for fix in fixes:
+            fix.apply(routes)
+        self.assertEqual(routes, new)
+
+    def test_rename_to_deleted_name(self):
+        old = {
+            'Foo': {'name': 'Foo', 'link': '/gpstracks/1-foo'},
+            'Bar': {'name': 'Bar', 'link': '/gpstracks/2-bar'},
+        }
+        new = {'Foo': {'name': 'Foo', 'link': '/gpstracks/2-bar'}}
+        fixes = list(route_diff.diff_routes(old, new))
+        self.assertEqual([f.kind for f in fixes], ['deleted', 'changed'])
+        routes = copy.deepcopy(old)
+        for fix in fixes:
+            fix.apply(routes)
+        self.assertEqual(routes, new)
+        # A deletion applied late still leaves the renamed route alone.
+        routes = copy.deepcopy(old)
+        for fix in reversed(fixes):
+            fix.apply(routes)
+        self.assertEqual(routes, new)
+
+
+class ParseCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'parse_cache.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        result = ({'name': 'Заглавие', 'length': Decimal('13.5'), 'water': False}, ['warning'])
+        cache = ParseCache(self.path, 'v1')
+        key = cache.key('<p>page</p>', False, 'html5lib')
+        self.assertIsNone(cache.get('demo', key))
+        cache.put('demo', key, result)
+        cache.save()
+        cache = ParseCache(self.path, 'v1')
+        self.assertEqual(cache.get('demo', key), result)
+        self.assertIsNone(cache.get('demo', cache.key('<p>page</p>', True, 'html5lib')))
+        self.assertIsNone(cache.get('demo', cache.key('<p>changed</p>', False, 'html5lib')))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_invalidation(self):
+        cache = ParseCache(self.path, 'v1')
+        key = cache.key('<p>page</p>')
+        cache.put('demo', key, (None, []))
+        cache.save()
+        self.assertIsNone(ParseCache(self.path, 'v2').get('demo', key))
+        self.assertIsNone(ParseCache(self.path, 'v1', enabled=False).get('demo', key))
+
+    def test_parser_fingerprint(self):
+        fingerprint = route_parser.parser_fingerprint()
+        self.assertEqual(route_parser.parser_fingerprint(), fingerprint)
+        route_parser.keys['Тест'] = 'test'
+        try:
+            self.assertNotEqual(route_parser.parser_fingerprint(), fingerprint)
+        finally:
+            del route_parser.keys['Тест']
+
 
 if __name__ == '__main__':
     unittest.main()
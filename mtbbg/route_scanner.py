@@ -1,29 +1,158 @@
+from __future__ import unicode_literals, print_function
+
+import argparse
 import os
+from datetime import datetime
 
-import requests
-from bs4 import BeautifulSoup
+import pytz
+import simplejson
+from bs4 import SoupStrainer
 
-from utils import BS4_PARSER
+from fetcher import PageFetcher
+from instrument import RunReport, profiled
+from utils import atomic_write, make_soup, read_json
 
 exec_root = os.path.dirname(__file__)
+SITE_ROOT = 'http://mtb-bg.com'
+INDEX_PATH = '/index.php/trails/index-routes'
+PAGE_PREFIX = '/index.php/trails/gpstracks/'
+KNOWN_PAGES_PATH = os.path.join(exec_root, 'known_pages.json')
+DELTA_PATH = os.path.join(exec_root, 'pages_delta.json')
 
 
-def main():
-    index = requests.get('http://mtb-bg.com/index.php/trails/index-routes')
-    index.raise_for_status()
-    q = BeautifulSoup(index.text, BS4_PARSER)
-    found = set()
-    with open(os.path.join(exec_root, 'pages.txt'), 'w') as f:
+def is_index_page(href):
+    """Whether href is a further page of the paginated route index."""
+    return href.startswith(INDEX_PATH) and 'start=' in href
+
+
+def scan_index(fetcher):
+    """Returns the route page links on the index, in the order they appear,
+    following its pagination links."""
+    found = []
+    seen = set()
+    queue = [INDEX_PATH]
+    visited = set(queue)
+    while queue:
+        index = fetcher.get(SITE_ROOT + queue.pop(0))
+        q = make_soup(index.text, SoupStrainer('a'))
         for link in q.find_all('a'):
             href = link.get('href')
             if not href:
                 continue
-            if href.startswith('/index.php/trails/gpstracks/'):
-                if href not in found:
-                    found.add(href)
-                    print(href)
-                    f.write(href + '\n')
-    print('Found {0} links'.format(len(found)))
+            if href.startswith(PAGE_PREFIX):
+                if href not in seen:
+                    seen.add(href)
+                    found.append(href)
+            elif is_index_page(href) and href not in visited:
+                visited.add(href)
+                queue.append(href)
+    return found
+
+
+def update_known_pages(known, found, now):
+    """Records a scan that found the pages in found at time now in known, a dict of
+    page -> {first_seen, last_seen[, removed]}. Returns the (added, removed) pages,
+    where added includes pages that reappeared after being removed."""
+    added = []
+    for href in found:
+        entry = known.get(href)
+        if entry is None:
+            known[href] = {'first_seen': now, 'last_seen': now}
+            added.append(href)
+        else:
+            if entry.pop('removed', None) is not None:
+                added.append(href)
+            entry['last_seen'] = now
+    found = set(found)
+    removed = []
+    for href, entry in sorted(known.items()):
+        if href not in found and 'removed' not in entry:
+            entry['removed'] = now
+            removed.append(href)
+    return added, removed
+
+
+def write_scan_json(path, data):
+    atomic_write(path, simplejson.dumps(data, indent=4, sort_keys=True))
+
+
+def read_delta(path=DELTA_PATH):
+    """The pages added and removed since route_parser --delta last ran."""
+    return read_json(path) if os.path.exists(path) else {'added': [], 'removed': []}
+
+
+def merge_delta(delta, added, removed):
+    """Adds the added and removed pages of a scan to delta, keeping the pages of
+    earlier scans the parser hasn't seen yet. A page's latest change wins."""
+    added_set, removed_set = set(added), set(removed)
+    pending_added = [href for href in delta['added'] if href not in removed_set]
+    pending_removed = [href for href in delta['removed'] if href not in added_set]
+    delta['added'] = pending_added + [href for href in added if href not in set(pending_added)]
+    delta['removed'] = pending_removed + [
+        href for href in removed if href not in set(pending_removed)]
+    return delta
+
+
+def consume_delta(consumed, path=DELTA_PATH):
+    """Drops the pages of consumed, a delta the parser has handled, from the delta
+    at path. Pages a scan added in the meantime stay."""
+    delta = read_delta(path)
+    for key in ('added', 'removed'):
+        done = set(consumed[key])
+        delta[key] = [href for href in delta[key] if href not in done]
+    write_scan_json(path, delta)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Find the route pages on the mtb-bg.com index and record which are new.')
+    parser.add_argument('--rate', type=float, default=4.0,
+                        help='Maximum requests per second to the site.')
+    parser.add_argument('--run-report', metavar='PATH',
+                        help='Write stage timings and counters to this JSON file.')
+    parser.add_argument('--profile', metavar='PATH',
+                        help='Run under cProfile and write the stats to this file.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    report = RunReport('route_scanner')
+    with profiled(args.profile):
+        run(args, report)
+    report.print_summary()
+    if args.run_report:
+        report.write(args.run_report)
+
+
+def run(args, report):
+    fetcher = PageFetcher(workers=1, rate=args.rate)
+    with report.stage('scan_index') as stage:
+        found = scan_index(fetcher)
+        stage.add(bytes_in=fetcher.bytes_fetched)
+    report.count('index_pages', fetcher.requests)
+    if not found:
+        # Most likely a broken page rather than every route being taken down.
+        raise Exception('No route links found on the index')
+    known = read_json(KNOWN_PAGES_PATH) if os.path.exists(KNOWN_PAGES_PATH) else {}
+    now = datetime.now(pytz.utc).replace(microsecond=0).isoformat()
+    added, removed = update_known_pages(known, found, now)
+    report.count('pages_found', len(found))
+    report.count('pages_added', len(added))
+    report.count('pages_removed', len(removed))
+    with report.stage('write'):
+        write_scan_json(KNOWN_PAGES_PATH, known)
+        delta = merge_delta(read_delta(), added, removed)
+        delta['scanned'] = now
+        write_scan_json(DELTA_PATH, delta)
+        atomic_write(os.path.join(exec_root, 'pages.txt'), ''.join(href + '\n' for href in found))
+    for href in added:
+        print('+', href)
+    for href in removed:
+        print('-', href)
+    print('Found {0} links, {1} new, {2} removed'.format(len(found), len(added), len(removed)))
+    print('{0} added and {1} removed pages are waiting for route_parser --delta'.format(
+        len(delta['added']), len(delta['removed'])))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import os
+import shutil
+import tempfile
+import unittest
+
+import route_scanner
+
+
+class FakeResponse(object):
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeFetcher(object):
+    def __init__(self, pages):
+        self.pages = pages
+        self.requested = []
+
+    def get(self, url):
+        self.requested.append(url)
+        return FakeResponse(self.pages[url])
+
+
+class ScannerTests(unittest.TestCase):
+    def test_scan_index_follows_pagination(self):
+        root = route_scanner.SITE_ROOT + route_scanner.INDEX_PATH
+        fetcher = FakeFetcher({
+            root: '<a href="/index.php/trails/gpstracks/a">A</a>'
+                  '<a href="/index.php/trails/gpstracks/b">B</a>'
+                  '<a href="/index.php/trails/index-routes?start=20">2</a>',
+            root + '?start=20': '<a href="/index.php/trails/gpstracks/b">B</a>'
+                                '<a href="/index.php/trails/gpstracks/c">C</a>'
+                                '<a href="/index.php/trails/index-routes?start=20">2</a>'
+                                '<a href="/index.php/about">About</a>',
+        })
+        self.assertEqual(route_scanner.scan_index(fetcher), [
+            '/index.php/trails/gpstracks/a',
+            '/index.php/trails/gpstracks/b',
+            '/index.php/trails/gpstracks/c',
+        ])
+        self.assertEqual(len(fetcher.requested), 2)
+
+    def test_update_known_pages(self):
+        known = {}
+        self.assertEqual(route_scanner.update_known_pages(known, ['/a', '/b'], 't1'),
+                         (['/a', '/b'], []))
+        self.assertEqual(route_scanner.update_known_pages(known, ['/b', '/c'], 't2'),
+                         (['/c'], ['/a']))
+        self.assertEqual(known['/a'], {'first_seen': 't1', 'last_seen': 't1', 'removed': 't2'})
+        self.assertEqual(known['/b'], {'first_seen': 't1', 'last_seen': 't2'})
+        self.assertEqual(route_scanner.update_known_pages(known, ['/a', '/b', '/c'], 't3'),
+                         (['/a'], []))
+        self.assertEqual(known['/a'], {'first_seen': 't1', 'last_seen': 't3'})
+
+    def test_merge_delta(self):
+        delta = {'added': ['/a', '/b'], 'removed': ['/c']}
+        self.assertEqual(route_scanner.merge_delta(delta, ['/c', '/d', '/a'], ['/b']),
+                         {'added': ['/a', '/c', '/d'], 'removed': ['/b']})
+
+    def test_consume_delta(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'pages_delta.json')
+            route_scanner.write_scan_json(path, {'added': ['/a'], 'removed': ['/b']})
+            consumed = route_scanner.read_delta(path)
+            # A scan between the parser reading the delta and finishing.
+            route_scanner.write_scan_json(path, route_scanner.merge_delta(
+                route_scanner.read_delta(path), ['/c'], []))
+            route_scanner.consume_delta(consumed, path)
+            self.assertEqual(route_scanner.read_delta(path), {'added': ['/c'], 'removed': []})
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,230 @@
+"""SQLite store for routes, the parse warnings and fetch state of their pages.
+
+    python route_store.py import routes.db   # load preprocessor/input.json
+    python route_store.py export routes.db   # write it back in the same layout
+    python route_store.py warnings routes.db # routes whose pages had warnings
+
+Every change is its own transaction, so the scanner, parser and preprocessor can
+use the same file at once.
+"""
+from __future__ import unicode_literals, print_function
+
+import argparse
+import os
+import sqlite3
+import sys
+
+import simplejson
+
+from utils import atomic_write
+
+exec_root = os.path.dirname(__file__)
+INPUT_JSON_PATH = os.path.join(exec_root, '..', 'preprocessor', 'input.json')
+INPUT_KEY_ORDER = [
+    'name', 'date', 'link', 'terrain', 'length', 'ascent',
+    'difficulty', 'strenuousness', 'duration', 'water', 'food',
+    'terrains', 'traces', 'routes', 'trailhead',
+]
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS routes (
+    name TEXT PRIMARY KEY,
+    link TEXT,
+    date TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS routes_link ON routes (link);
+CREATE INDEX IF NOT EXISTS routes_date ON routes (date);
+CREATE TABLE IF NOT EXISTS traces (
+    route_name TEXT NOT NULL REFERENCES routes (name) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    PRIMARY KEY (route_name, position)
+);
+CREATE INDEX IF NOT EXISTS traces_url ON traces (url);
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    sha1 TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    parsed TEXT,
+    warnings TEXT NOT NULL DEFAULT '[]'
+);
+'''
+# Columns added to tables after stores were first created, as (table, column, type).
+ADDED_COLUMNS = [
+    ('pages', 'etag', 'TEXT'),
+    ('pages', 'last_modified', 'TEXT'),
+]
+
+
+def write_input_json(path, routes):
+    """Writes a name -> route dict in the input.json layout: routes sorted by date
+    and name, keys in INPUT_KEY_ORDER."""
+    route_list = sorted(routes.values(), key=lambda r: (r['date'], r['name']))
+    value = simplejson.dumps(
+        {'routes': route_list},
+        indent='  ',
+        item_sort_key=lambda i: INPUT_KEY_ORDER.index(i[0]),
+        ensure_ascii=False,
+    )
+    # Ends with a newline like the checked in file, so exports diff cleanly.
+    atomic_write(path, value + '\n')
+
+
+class RouteStore(object):
+    def __init__(self, path, create=False):
+        # sqlite3 would create a missing file, and a mistyped path would then
+        # look like a store without routes.
+        if not create and not os.path.exists(path):
+            raise IOError('No route store at {0}'.format(path))
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA foreign_keys = ON')
+        self.db.executescript(SCHEMA)
+        for table, column, column_type in ADDED_COLUMNS:
+            columns = [row[1] for row in self.db.execute('PRAGMA table_info({0})'.format(table))]
+            if column not in columns:
+                self.db.execute('ALTER TABLE {0} ADD COLUMN {1} {2}'.format(
+                    table, column, column_type))
+
+    def close(self):
+        self.db.close()
+
+    def _load(self, rows):
+        return [simplejson.loads(data, use_decimal=True) for data, in rows]
+
+    def routes(self):
+        """All routes as a name -> route dict, like route_parser.read_routes."""
+        return {r['name']: r for r in self._load(
+            self.db.execute('SELECT data FROM routes ORDER BY date, name'))}
+
+    def get(self, name):
+        routes = self._load(self.db.execute('SELECT data FROM routes WHERE name = ?', (name,)))
+        return routes[0] if routes else None
+
+    def by_link(self, link):
+        return self._load(self.db.execute('SELECT data FROM routes WHERE link = ?', (link,)))
+
+    def between(self, start, end):
+        """Routes dated start <= date < end, as ISO strings."""
+        return self._load(self.db.execute(
+            'SELECT data FROM routes WHERE date >= ? AND date < ? ORDER BY date, name',
+            (start, end)))
+
+    def by_trace(self, url):
+        return self._load(self.db.execute(
+            'SELECT data FROM routes JOIN traces ON traces.route_name = routes.name '
+            'WHERE traces.url = ? ORDER BY date, name', (url,)))
+
+    def _put(self, route):
+        self.db.execute(
+            'INSERT OR REPLACE INTO routes (name, link, date, data) VALUES (?, ?, ?, ?)',
+            (route['name'], route.get('link'), route.get('date'), simplejson.dumps(route)))
+        self.db.execute('DELETE FROM traces WHERE route_name = ?', (route['name'],))
+        self.db.executemany(
+            'INSERT INTO traces (route_name, position, url) VALUES (?, ?, ?)',
+            [(route['name'], i, url) for i, url in enumerate(route.get('traces', []))])
+
+    def _delete(self, name):
+        self.db.execute('DELETE FROM routes WHERE name = ?', (name,))
+
+    def put(self, route):
+        with self.db:
+            self._put(route)
+
+    def delete(self, name):
+        with self.db:
+            self._delete(name)
+
+    def apply_fix(self, fix, routes):
+        """Writes the rows touched by fix, already applied to the routes dict, as
+        they are in routes: names no longer in it are deleted."""
+        if fix.kind == 'added':
+            names = [fix.new['name']]
+        elif fix.key == 'name':
+            names = [fix.old, fix.new]
+        else:
+            names = [fix.route_name]
+        with self.db:
+            for name in names:
+                if name in routes:
+                    self._put(routes[name])
+                else:
+                    self._delete(name)
+
+    def replace_all(self, routes):
+        """Replaces every route with the name -> route dict routes."""
+        with self.db:
+            self.db.execute('DELETE FROM routes')
+            for route in routes.values():
+                self._put(route)
+
+    def record_page(self, url, fetch, parsed, warnings):
+        """Records the parse of a page. fetch is its fetcher.CacheMetadata entry,
+        with the sha1, etag and last_modified of the fetched content."""
+        self.record_pages([(url, fetch, parsed, warnings)])
+
+    def record_pages(self, pages):
+        """record_page for many (url, fetch, parsed, warnings) at once."""
+        with self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO pages (url, sha1, etag, last_modified, parsed, warnings) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(url, fetch.get('sha1'), fetch.get('etag'), fetch.get('last_modified'), parsed,
+                  simplejson.dumps(warnings, ensure_ascii=False))
+                 for url, fetch, parsed, warnings in pages])
+
+    def page_fetch(self, url):
+        """The sha1, etag and last_modified a page was last parsed at, or None."""
+        rows = self.db.execute(
+            'SELECT sha1, etag, last_modified FROM pages WHERE url = ?', (url,)).fetchall()
+        return dict(zip(('sha1', 'etag', 'last_modified'), rows[0])) if rows else None
+
+    def pages_with_warnings(self):
+        """Returns (page URL, route name or None, warnings) of every page that had
+        parse warnings."""
+        return [
+            (url, name, simplejson.loads(warnings))
+            for url, name, warnings in self.db.execute(
+                'SELECT pages.url, routes.name, pages.warnings FROM pages '
+                'LEFT JOIN routes ON routes.link = pages.url '
+                "WHERE pages.warnings != '[]' ORDER BY pages.url")
+        ]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Manage the SQLite route store.')
+    parser.add_argument('command', choices=['import', 'export', 'warnings'])
+    parser.add_argument('store', help='Path to the SQLite database.')
+    parser.add_argument('--json', default=INPUT_JSON_PATH,
+                        help='input.json to import from or export to.')
+    args = parser.parse_args()
+    if args.command != 'import' and not os.path.exists(args.store):
+        parser.error('no route store at {0}, create one with import'.format(args.store))
+    return args
+
+
+def main():
+    args = parse_args()
+    store = RouteStore(args.store, create=args.command == 'import')
+    if args.command == 'import':
+        with open(args.json, 'r') as f:
+            routes = simplejson.loads(f.read(), use_decimal=True)['routes']
+        if len(set(r['name'] for r in routes)) != len(routes):
+            sys.exit('Duplicate route names in {0}. Can\'t import.'.format(args.json))
+        store.replace_all({r['name']: r for r in routes})
+        print('Imported {0} routes'.format(len(routes)))
+    elif args.command == 'export':
+        routes = store.routes()
+        write_input_json(args.json, routes)
+        print('Exported {0} routes'.format(len(routes)))
+    else:
+        for url, name, warnings in store.pages_with_warnings():
+            print('On route {0}:'.format(name or url))
+            for warning in warnings:
+                print(' -', warning)
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
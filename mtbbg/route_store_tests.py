@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import copy
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from decimal import Decimal
+
+import route_diff
+from route_store import RouteStore, write_input_json
+
+
+def make_route(name, article_id, date, traces=()):
+    return {
+        'name': name,
+        'date': date,
+        'link': 'http://mtb-bg.com/index.php/trails/gpstracks/{0}-route'.format(article_id),
+        'length': Decimal('12.5'),
+        'traces': list(traces),
+    }
+
+
+class RouteStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = RouteStore(os.path.join(self.dir, 'routes.db'), create=True)
+        self.routes = {
+            'Б': make_route('Б', 2, '2010-01-01T10:00:00+02:00', ['http://mtb-bg.com/b.gpx']),
+            'А': make_route('А', 1, '2009-05-01T10:00:00+03:00',
+                            ['http://mtb-bg.com/a.gpx', 'http://mtb-bg.com/b.gpx']),
+        }
+        self.store.replace_all(self.routes)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.dir)
+
+    def test_lookups(self):
+        self.assertEqual(self.store.routes(), self.routes)
+        self.assertEqual(list(self.store.routes()), ['А', 'Б'])
+        self.assertEqual(self.store.get('А')['length'], Decimal('12.5'))
+        self.assertIsNone(self.store.get('В'))
+        self.assertEqual(self.store.by_link(self.routes['Б']['link']), [self.routes['Б']])
+        self.assertEqual([r['name'] for r in self.store.between('2009', '2010')], ['А'])
+        self.assertEqual([r['name'] for r in self.store.by_trace('http://mtb-bg.com/b.gpx')],
+                         ['А', 'Б'])
+
+    def test_apply_fix(self):
+        new_routes = copy.deepcopy(self.routes)
+        renamed = new_routes.pop('Б')
+        renamed['name'] = 'В'
+        renamed['traces'] = ['http://mtb-bg.com/c.gpx']
+        new_routes['В'] = renamed
+        del new_routes['А']
+        new_routes['Г'] = make_route('Г', 3, '2011-01-01T10:00:00+02:00')
+        routes = copy.deepcopy(self.routes)
+        for fix in route_diff.diff_routes(self.routes, new_routes):
+            fix.apply(routes)
+            self.store.apply_fix(fix, routes)
+        self.assertEqual(self.store.routes(), new_routes)
+        self.assertEqual([r['name'] for r in self.store.by_trace('http://mtb-bg.com/b.gpx')], [])
+        self.assertEqual([r['name'] for r in self.store.by_trace('http://mtb-bg.com/c.gpx')],
+                         ['В'])
+
+    def test_apply_fix_rename_to_deleted_name(self):
+        new_routes = {'А': dict(self.routes['Б'], name='А')}
+        routes = copy.deepcopy(self.routes)
+        for fix in route_diff.diff_routes(self.routes, new_routes):
+            fix.apply(routes)
+            self.store.apply_fix(fix, routes)
+        self.assertEqual(self.store.routes(), new_routes)
+
+    def test_pages_with_warnings(self):
+        self.store.record_pages([
+            (self.routes['А']['link'], {'sha1': 'abc'}, '2020-01-01T00:00:00', ['Unknown key']),
+            (self.routes['Б']['link'], {'sha1': 'def'}, '2020-01-01T00:00:00', []),
+            ('http://mtb-bg.com/other', {}, '2020-01-01T00:00:00', ['No name']),
+        ])
+        self.assertEqual(self.store.pages_with_warnings(), [
+            (self.routes['А']['link'], 'А', ['Unknown key']),
+            ('http://mtb-bg.com/other', None, ['No name']),
+        ])
+
+    def test_page_fetch(self):
+        self.assertIsNone(self.store.page_fetch('http://mtb-bg.com/other'))
+        self.store.record_page('http://mtb-bg.com/other', {
+            'sha1': 'abc', 'etag': '"1-2"', 'last_modified': 'Wed, 22 Jan 2014 18:30:00 GMT',
+            'size': 10,
+        }, '2020-01-01T00:00:00', [])
+        self.assertEqual(self.store.page_fetch('http://mtb-bg.com/other'), {
+            'sha1': 'abc', 'etag': '"1-2"', 'last_modified': 'Wed, 22 Jan 2014 18:30:00 GMT',
+        })
+
+    def test_adds_new_columns(self):
+        path = os.path.join(self.dir, 'old.db')
+        db = sqlite3.connect(path)
+        db.execute("CREATE TABLE pages (url TEXT PRIMARY KEY, sha1 TEXT, parsed TEXT, "
+                   "warnings TEXT NOT NULL DEFAULT '[]')")
+        db.close()
+        store = RouteStore(path)
+        store.record_page('demo', {'etag': 'x'}, None, [])
+        self.assertEqual(store.page_fetch('demo')['etag'], 'x')
+        store.close()
+
+    def test_missing_store(self):
+        path = os.path.join(self.dir, 'typo.db')
+        self.assertRaises(IOError, RouteStore, path)
+        self.assertFalse(os.path.exists(path))
+
+    def test_export_is_stable(self):
+        path = os.path.join(self.dir, 'input.json')
+        write_input_json(path, self.store.routes())
+        with open(path, 'rb') as f:
+            first = f.read()
+        write_input_json(path, self.routes)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), first)
+        self.assertTrue(first.endswith(b'\n'))
+        self.assertLess(first.index('А'.encode('utf-8')), first.index('Б'.encode('utf-8')))
+
+
+if __name__ == '__main__':
+    unittest.main()
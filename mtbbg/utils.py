@@ -1,22 +1,83 @@
 from __future__ import unicode_literals, print_function
 
-import io
+import os
+import tempfile
 from decimal import Decimal
 
 import simplejson
+from bs4 import BeautifulSoup
+
+# html5lib builds the same tree as a browser, but is by far the slowest. lxml and
+# html.parser can be selected with MTBBG_BS4_PARSER; check them against the
+# html5lib results with parser_regression.py before relying on them. html.parser
+# doesn't close <p> elements implicitly, so metadata blocks can run together.
+BS4_PARSER = os.environ.get('MTBBG_BS4_PARSER', 'html5lib')
+# The umask can only be read by setting it, which would race with files created
+# by other threads, so it's read once on import.
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def make_soup(content, parse_only=None, parser=None):
+    """Parses content with the configured parser. parse_only, a SoupStrainer,
+    restricts the tree to the elements it matches. html5lib ignores it and always
+    builds the full tree."""
+    parser = parser or BS4_PARSER
+    if parser == 'html5lib':
+        parse_only = None
+    return BeautifulSoup(content, parser, parse_only=parse_only)
 
-BS4_PARSER = 'html5lib'
 
 def read_json(path):
     with open(path, 'r') as f:
         return simplejson.loads(f.read(), use_decimal=True)
 
 
+def target_mode(path, directory=False):
+    """The mode for a file or directory that's about to replace path: the mode of
+    path, or what a plain open() or os.mkdir() would have given it."""
+    if os.path.exists(path):
+        return os.stat(path).st_mode & 0o777
+    return (0o777 if directory else 0o666) & ~UMASK
+
+
+def open_temp(path):
+    """Opens a binary temp file in the directory of path, for commit_temp to put in
+    its place. Returns (temp path, file)."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    return tmp_path, os.fdopen(fd, 'wb')
+
+
+def commit_temp(tmp_path, path):
+    # mkstemp creates the file private.
+    os.chmod(tmp_path, target_mode(path))
+    os.replace(tmp_path, path)
+
+
+def discard_temp(tmp_path):
+    if os.path.exists(tmp_path):
+        os.unlink(tmp_path)
+
+
+def atomic_write(path, data):
+    """Write data to path through a temp file in the same directory, so readers
+    never see a truncated file."""
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    tmp_path, f = open_temp(path)
+    try:
+        with f:
+            f.write(data)
+        commit_temp(tmp_path, path)
+    except BaseException:
+        discard_temp(tmp_path)
+        raise
+
+
 def write_json(path, data, dumps_params):
     value = simplejson.dumps(data, **dumps_params)
-    with io.open(path, 'w', encoding='utf-8') as f:
-        f.write(value)
-        return len(value)
+    atomic_write(path, value)
+    return len(value)
 
 
 def parse_decimal(s):
@@ -24,10 +85,18 @@ def parse_decimal(s):
 
 
 class ParseResultFix(object):
-    def __init__(self, route_name, text, action):
+    """One difference between input.json and the parsed pages. kind is 'added',
+    'deleted' or 'changed'; changes also carry the key and its old and new value,
+    None meaning the key is missing."""
+
+    def __init__(self, route_name, text, action, kind='changed', key=None, old=None, new=None):
         self.route_name = route_name
         self.text = text
         self.action = action
+        self.kind = kind
+        self.key = key
+        self.old = old
+        self.new = new
 
     def interact(self):
         print(self.text)
@@ -0,0 +1,39 @@
+import hashlib
+import os
+
+import simplejson
+
+import shared  # noqa: F401
+from utils import atomic_write
+
+
+class ArtifactCache(object):
+    """Processed output of single trace files, stored as one JSON file per key in
+    cache_dir. Keys are derived from the trace content hash and everything else
+    the output depends on, so stale entries are never read back."""
+
+    def __init__(self, cache_dir, enabled=True):
+        self.cache_dir = cache_dir
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha1(':'.join(map(repr, parts)).encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def get(self, key):
+        if self.enabled and os.path.exists(self.path(key)):
+            self.hits += 1
+            with open(self.path(key), 'r') as f:
+                return simplejson.load(f)
+        self.misses += 1
+        return None
+
+    def put(self, key, artifact):
+        atomic_write(self.path(key), simplejson.dumps(artifact))
@@ -0,0 +1,122 @@
+"""Packed route geometry, an alternative to the polylines in routes.json.
+
+Layout, all integers little-endian:
+
+    b'MTBR', uint32 version
+    one record per route:
+        varint segment count
+        per segment: varint point count, then zig-zag varint deltas of
+        latitude and longitude in 1e-5 degrees, starting from 0
+    zero padding to a multiple of 4 bytes
+    uint32 offset of every route record, uint32 route count
+
+Route metadata goes into a JSON sidecar, in the same order as the records.
+"""
+import gzip
+import io
+import os
+import struct
+
+import numpy as np
+
+import shared  # noqa: F401
+from polyline_codec import decode_ints, split_chunks, zigzag
+from route_writer import StagedFile, stage_json
+from utils import commit_temp, discard_temp, open_temp
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MAGIC = b'MTBR'
+VERSION = 1
+PRECISION = 5
+
+
+def varints(values):
+    return split_chunks(np.asarray(values, dtype=np.int64), 7, 0x80, 0).tobytes()
+
+
+def encode_route(polylines):
+    parts = [varints([len(polylines)])]
+    for poly in polylines:
+        coords = decode_ints(poly)
+        deltas = np.diff(coords, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+        parts.append(varints([len(coords)]))
+        if len(deltas):
+            parts.append(varints(zigzag(deltas)))
+    return b''.join(parts)
+
+
+def stage_compressed(path, data):
+    """StagedFiles of data compressed as path.gz and, if the brotli module is
+    available, path.br."""
+    buf = io.BytesIO()
+    with gzip.GzipFile(os.path.basename(path), 'wb', 9, buf, mtime=0) as f:
+        f.write(data)
+    staged = [StagedFile(path + '.gz', buf.getvalue())]
+    if brotli is not None:
+        staged.append(StagedFile(path + '.br', brotli.compress(data)))
+    return staged
+
+
+class BinaryRoutesWriter(object):
+    """Writes route records as they are added, through a temp file that only
+    replaces path, along with its precompressed variants, once close() has
+    written the offset table. finish() and commit() do the same in two steps."""
+
+    def __init__(self, path):
+        self.path = path
+        self.offsets = []
+        self.compressed = []
+        self.tmp_path, self.f = open_temp(path)
+        self.f.write(MAGIC + struct.pack('<I', VERSION))
+
+    def add(self, polylines):
+        self.offsets.append(self.f.tell())
+        self.f.write(encode_route(polylines))
+
+    def close(self):
+        size = self.finish()
+        self.commit()
+        return size
+
+    def finish(self):
+        """Writes the offset table and the compressed variants. Returns the size."""
+        self.f.write(b'\0' * (-self.f.tell() % 4))
+        self.f.write(struct.pack('<{0}I'.format(len(self.offsets)), *self.offsets))
+        self.f.write(struct.pack('<I', len(self.offsets)))
+        self.f.close()
+        with open(self.tmp_path, 'rb') as f:
+            data = f.read()
+        self.compressed = stage_compressed(self.path, data)
+        return len(data)
+
+    def commit(self):
+        commit_temp(self.tmp_path, self.path)
+        for staged in self.compressed:
+            staged.commit()
+
+    def abort(self):
+        self.f.close()
+        for staged in self.compressed:
+            staged.abort()
+        discard_temp(self.tmp_path)
+
+
+def stage_meta(meta_path, entries):
+    """StagedFiles of the JSON sidecar of the route records, entries being the
+    metadata of each route in record order, and its precompressed variants."""
+    meta = stage_json(meta_path, {
+        'format': MAGIC.decode('ascii'),
+        'version': VERSION,
+        'precision': PRECISION,
+        'routes': entries,
+    }, {'ensure_ascii': False})
+    try:
+        with open(meta.tmp_path, 'rb') as f:
+            return [meta] + stage_compressed(meta_path, f.read())
+    except BaseException:
+        meta.abort()
+        raise
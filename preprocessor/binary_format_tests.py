@@ -0,0 +1,124 @@
+import gzip
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+import simplejson
+
+from binary_format import MAGIC, PRECISION, VERSION, BinaryRoutesWriter, stage_meta
+from polyline_codec import decode_ints, encode
+
+ROUTES = [
+    {'name': 'Витоша', 'stats': {'distance': 12.5, 'ascent': 800, 'descent': 790, 'points': 4},
+     'polylines': [encode([[42.56, 23.28], [42.57, 23.29], [42.5612, 23.27]]),
+                   encode([[-33.9, 151.2]])]},
+    {'name': 'Empty', 'polylines': []},
+    {'name': 'Far', 'stats': {'distance': 3000.0, 'ascent': 0, 'descent': 0, 'points': 2},
+     'polylines': [encode([[10.0, -170.0], [-10.0, 170.0]])]},
+]
+
+
+def read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, pos
+
+
+def decode_routes(data):
+    """Decodes routes.bin the way the layout in binary_format describes it:
+    per route, the segments as lists of integer (lat, lon) pairs."""
+    assert data[:4] == MAGIC
+    assert struct.unpack('<I', data[4:8])[0] == VERSION
+    count, = struct.unpack('<I', data[-4:])
+    offsets = struct.unpack('<{0}I'.format(count), data[-4 - 4 * count:-4])
+    assert (len(data) - 4 - 4 * count) % 4 == 0
+    routes = []
+    for offset in offsets:
+        segment_count, pos = read_varint(data, offset)
+        segments = []
+        for _ in range(segment_count):
+            point_count, pos = read_varint(data, pos)
+            lat = lon = 0
+            points = []
+            for _ in range(point_count):
+                for i in range(2):
+                    value, pos = read_varint(data, pos)
+                    delta = ~(value >> 1) if value & 1 else value >> 1
+                    if i == 0:
+                        lat += delta
+                    else:
+                        lon += delta
+                points.append([lat, lon])
+            segments.append(points)
+        routes.append(segments)
+    return routes
+
+
+class BinaryFormatTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        path = os.path.join(self.dir, 'routes.bin')
+        meta_path = os.path.join(self.dir, 'routes_meta.json')
+        writer = BinaryRoutesWriter(path)
+        for route in ROUTES:
+            writer.add(route['polylines'])
+        size = writer.close()
+        for staged in stage_meta(meta_path, [{k: v for k, v in route.items()
+                                              if k != 'polylines'} for route in ROUTES]):
+            staged.commit()
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.assertEqual(size, len(data))
+        decoded = decode_routes(data)
+        self.assertEqual(len(decoded), len(ROUTES))
+        for route, segments in zip(ROUTES, decoded):
+            self.assertEqual(segments, [decode_ints(p).tolist() for p in route['polylines']])
+            self.assertEqual([encode(np.array(s) / 10.0 ** PRECISION) for s in segments],
+                             route['polylines'])
+        with open(meta_path, 'rb') as f:
+            meta = simplejson.loads(f.read().decode('utf-8'))
+        self.assertEqual((meta['format'], meta['version'], meta['precision']),
+                         (MAGIC.decode('ascii'), VERSION, PRECISION))
+        self.assertEqual([r['name'] for r in meta['routes']], [r['name'] for r in ROUTES])
+        self.assertEqual(meta['routes'][0]['stats'], ROUTES[0]['stats'])
+        self.assertEqual(sum(map(len, decoded[0])), 4)
+
+    def test_compressed(self):
+        path = os.path.join(self.dir, 'routes.bin')
+        writer = BinaryRoutesWriter(path)
+        writer.add(ROUTES[0]['polylines'])
+        size = writer.finish()
+        self.assertEqual(sorted(os.listdir(self.dir)), sorted(
+            [os.path.basename(writer.tmp_path)] +
+            [os.path.basename(s.tmp_path) for s in writer.compressed]))
+        writer.commit()
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.assertEqual(len(data), size)
+        with gzip.open(path + '.gz', 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_abort(self):
+        path = os.path.join(self.dir, 'routes.bin')
+        writer = BinaryRoutesWriter(path)
+        writer.add(ROUTES[0]['polylines'])
+        writer.finish()
+        writer.abort()
+        self.assertEqual(os.listdir(self.dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import hashlib
+import os
+
+import shared  # noqa: F401
+from utils import commit_temp, discard_temp, open_temp
+
+
+def download(session, url, cache_path, metadata=None, revalidate=False, timeout=30):
+    """Streams url into cache_path through a temp file. An existing cache_path is
+    left alone, unless revalidate is set and the server reports a change.
+    timeout, in seconds, applies to connecting and to every read, so a server that
+    stops sending fails the download instead of blocking a worker. Returns
+    whether cache_path was written."""
+    name = os.path.basename(cache_path)
+    headers = {}
+    if os.path.exists(cache_path):
+        if not revalidate:
+            return False
+        if metadata is not None:
+            headers = metadata.conditional_headers(name)
+        print('Revalidating', url)
+    else:
+        print('Downloading', url)
+    # Closing the response releases its pooled connection, whatever happens.
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as resp:
+        resp.raise_for_status()
+        if resp.status_code == 304:
+            if metadata is not None:
+                metadata.mark_checked(name)
+            return False
+        sha1 = hashlib.sha1()
+        size = 0
+        tmp_path, f = open_temp(cache_path)
+        try:
+            with f:
+                for chunk in resp.iter_content(chunk_size=65536):
+                    f.write(chunk)
+                    sha1.update(chunk)
+                    size += len(chunk)
+            if metadata is not None:
+                metadata.record(name, resp.headers, size, sha1.hexdigest(),
+                                metadata.known_sha1(name, cache_path))
+            commit_temp(tmp_path, cache_path)
+        except BaseException:
+            discard_temp(tmp_path)
+            raise
+    return True
@@ -0,0 +1,84 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import requests
+
+from downloads import download
+
+
+class FakeResponse(object):
+    headers = {}
+
+    def __init__(self, status_code, content=b''):
+        self.status_code = status_code
+        self.content = content
+        self.closed = False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(self.status_code)
+
+    def iter_content(self, chunk_size):
+        yield self.content
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FakeSession(object):
+    def __init__(self, response):
+        self.response = response
+        self.timeout = None
+
+    def get(self, url, headers=None, stream=False, timeout=None):
+        self.timeout = timeout
+        return self.response
+
+
+class DownloadTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'track.gpx')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def download(self, session, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return download(session, 'http://mtb-bg.com/track.gpx', self.path, **kwargs)
+
+    def test_download(self):
+        session = FakeSession(FakeResponse(200, b'<gpx/>'))
+        self.assertTrue(self.download(session, timeout=5))
+        self.assertEqual(session.timeout, 5)
+        self.assertTrue(session.response.closed)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b'<gpx/>')
+
+    def test_not_modified(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'<gpx/>')
+        session = FakeSession(FakeResponse(304))
+        self.assertFalse(self.download(session, revalidate=True))
+        self.assertEqual(session.timeout, 30)
+        self.assertTrue(session.response.closed)
+
+    def test_error(self):
+        session = FakeSession(FakeResponse(404))
+        self.assertRaises(requests.HTTPError, self.download, session)
+        self.assertTrue(session.response.closed)
+        self.assertEqual(os.listdir(self.dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
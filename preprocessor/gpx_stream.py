@@ -0,0 +1,66 @@
+from xml.etree import ElementTree
+
+import gpxpy
+import numpy as np
+
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def to_array(points):
+    return np.array(points, dtype=np.float64).reshape(-1, 3)
+
+
+def iter_segments(f):
+    """Yields every track segment in a GPX file object as an (N, 3) float64 array
+    of (latitude, longitude, elevation), elevation being NaN for points without
+    one. Elements are discarded as soon as they are read, so memory use is bounded
+    by the coordinates alone."""
+    points = None
+    in_trkpt = False
+    elevation = None
+    for event, elem in ElementTree.iterparse(f, events=('start', 'end')):
+        tag = local_name(elem.tag)
+        if event == 'start':
+            if tag == 'trkseg':
+                points = []
+            elif tag == 'trkpt':
+                in_trkpt = True
+                elevation = None
+        elif tag == 'ele':
+            # Waypoints and routes have elevations too.
+            if in_trkpt:
+                elevation = elem.text
+        elif tag == 'trkpt':
+            if points is not None:
+                points.append(float(elem.get('lat')))
+                points.append(float(elem.get('lon')))
+                points.append(float(elevation) if elevation and elevation.strip() else np.nan)
+            in_trkpt = False
+            elem.clear()
+        elif tag == 'trkseg':
+            yield to_array(points)
+            points = None
+            elem.clear()
+        elif tag == 'trk':
+            elem.clear()
+
+
+def read_segments(open_source):
+    """Returns the track segments of the GPX returned by open_source(), a callable
+    that opens a fresh binary file object. Files the streaming parser rejects
+    are handed to gpxpy, which is more lenient about malformed input."""
+    try:
+        with open_source() as f:
+            return list(iter_segments(f))
+    except ElementTree.ParseError:
+        pass
+    with open_source() as f:
+        gpx = gpxpy.parse(f.read().decode())
+    return [
+        to_array([(p.latitude, p.longitude, np.nan if p.elevation is None else p.elevation)
+                  for p in segment.points])
+        for track in gpx.tracks
+        for segment in track.segments
+    ]
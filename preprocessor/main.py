@@ -1,15 +1,46 @@
-import io
+import argparse
+import hashlib
 import os
-from itertools import chain
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from zipfile import ZipFile
 
-import gpxpy
+import numpy as np
 import requests
 import simplejson
-from polyline.codec import PolylineCodec
 from shapely.geometry.linestring import LineString
 
+import shared  # noqa: F401
+from artifacts import ArtifactCache
+from binary_format import BinaryRoutesWriter, stage_meta
+from downloads import download
+from fetcher import CacheMetadata, file_sha1, make_session
+from gpx_stream import read_segments
+from instrument import RunReport, profiled
+from polyline_codec import decode, encode
+from route_store import RouteStore
+from route_writer import StreamingRoutesWriter, stage_json
+from spatial_index import NEARBY_KM, RouteIndex
+from tiles import TILE_ZOOM, TileWriter, index_entry, lod_zooms
+from trace_dedup import TraceTable, geometry_signature, near_duplicates, route_cells
+from trace_stats import check_stats, merge_stats, segments_stats
+
 exec_root = os.path.dirname(__file__)
+web_root = os.path.join(exec_root, '..', 'web')
+
+SIMPLIFY_TOLERANCE = 0.0001
+# Coarser simplifications for the map, as (min_zoom, tolerance): roughly half a
+# pixel at the highest zoom of each band. From zoom 13 on, the full
+# SIMPLIFY_TOLERANCE polylines are used.
+LOD_LEVELS = [
+    (9, 0.0005),
+    (11, 0.00015),
+]
+FULL_DETAIL_ZOOM = 13
+# Bump whenever the output of process_trace changes for the same input file.
+ENCODER_VERSION = 5
 
 
 def read_json(path):
@@ -17,81 +48,399 @@ def read_json(path):
         return simplejson.loads(f.read(), use_decimal=True)
 
 
-def write_json(path, data, dumps_params):
-    value = simplejson.dumps(data, **dumps_params)
-    with io.open(path, 'w', encoding='utf-8') as f:
-        f.write(value)
-    return len(value)
-
-
-def extract_segments_from_gpx(gpx):
-    for track in gpx.tracks:
-        for segment in track.segments:
-            yield segment
+def read_store(path):
+    """Reads the routes of a route store made by mtbbg/route_store.py, in the same
+    order as input.json."""
+    store = RouteStore(path)
+    try:
+        return {'routes': list(store.routes().values())}
+    finally:
+        store.close()
 
 
-def extract_gpxes(cache_path):
+def extract_segments(cache_path):
     if cache_path.lower().endswith('.gpx'):
         print('Parsing', cache_path)
-        with open(cache_path) as f:
-            yield gpxpy.parse(f)
+        for segment in read_segments(lambda: open(cache_path, 'rb')):
+            yield segment
     elif cache_path.lower().endswith('.zip'):
         print('Opening ZIP', cache_path)
-        z = ZipFile(cache_path)
-        for file_info in z.filelist:
-            if file_info.filename.lower().endswith('.gpx'):
-                print('Parsing', cache_path + '/' + file_info.filename)
-                with z.open(file_info) as f:
-                    xml = f.read().decode()
-                    yield gpxpy.parse(xml)
+        with ZipFile(cache_path) as z:
+            for file_info in z.filelist:
+                if file_info.filename.lower().endswith('.gpx'):
+                    print('Parsing', cache_path + '/' + file_info.filename)
+                    for segment in read_segments(lambda: z.open(file_info)):
+                        yield segment
     else:
         raise Exception('Unsupported file type ' + cache_path)
 
 
-def get_gpxes(trace_url):
-    cache_path = os.path.join(exec_root, 'cache', os.path.basename(trace_url))
-    if not os.path.exists(cache_path):
-        print('Downloading', trace_url)
-        with open(cache_path, 'wb') as f:
-            resp = requests.get(trace_url, stream=True)
-            resp.raise_for_status()
-            for chunk in resp.iter_content(chunk_size=4096):
-                f.write(chunk)
-    for gpx in extract_gpxes(cache_path):
-        yield gpx
+def trace_cache_path(trace_url):
+    """Where trace_url is cached. Keyed by a hash of the whole URL, as different
+    traces often share a file name, but keeping the name for its extension."""
+    url_hash = hashlib.sha1(trace_url.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(exec_root, 'cache', '{0}-{1}'.format(url_hash, os.path.basename(trace_url)))
+
+
+def prefetch_traces(trace_urls, session, metadata, revalidate=False, workers=8, report=None):
+    """Downloads every distinct URL in trace_urls, workers at a time. Returns a
+    dict of URL -> (cache path, formatted traceback or None)."""
+    report = report or RunReport('prefetch')
+
+    def fetch(trace_url):
+        cache_path = trace_cache_path(trace_url)
+        try:
+            written = download(session or requests, trace_url, cache_path, metadata, revalidate)
+        except Exception:
+            return trace_url, None, traceback.format_exc(), False
+        return trace_url, cache_path, None, written
+
+    unique_urls = list(dict.fromkeys(trace_urls))
+    traces = {}
+    with report.stage('download') as stage:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for trace_url, cache_path, error, written in executor.map(fetch, unique_urls):
+                traces[trace_url] = (cache_path, error)
+                if written:
+                    report.count('traces_downloaded')
+                    stage.add(bytes_in=os.path.getsize(cache_path))
+    report.count('traces', len(unique_urls))
+    report.count('trace_download_errors', sum(1 for _, error in traces.values() if error))
+    return traces
 
 
-def segment_to_polyline(segment):
-    points = [(p.latitude, p.longitude) for p in segment.points]
+def segment_to_polyline(points, tolerance=SIMPLIFY_TOLERANCE):
+    if len(points) < 2:
+        # Nothing to simplify, and not a valid LineString.
+        return np.asarray(points)
     ls = LineString(points)
-    ls = ls.simplify(0.0001)
-    return ls.coords
+    ls = ls.simplify(tolerance)
+    return np.asarray(ls.coords)
 
 
-def process_route(route):
+def polyline_bbox(points):
+    """Returns [min_lat, min_lon, max_lat, max_lon] of an (N, 2) array."""
+    return [round(float(v), 5) for v in np.concatenate([points.min(axis=0), points.max(axis=0)])]
+
+
+def merge_bboxes(bboxes):
+    return [
+        min(b[0] for b in bboxes),
+        min(b[1] for b in bboxes),
+        max(b[2] for b in bboxes),
+        max(b[3] for b in bboxes),
+    ]
+
+
+def process_trace(cache_path, artifacts, report=None):
+    report = report or RunReport('process_trace')
+    sha1 = file_sha1(cache_path)
+    key = artifacts.key(sha1, SIMPLIFY_TOLERANCE, LOD_LEVELS, ENCODER_VERSION)
+    artifact = artifacts.get(key)
+    if artifact is None:
+        with report.stage('extract') as stage:
+            # Empty <trkseg>s have nothing to draw, bound or start from.
+            segments = [segment for segment in extract_segments(cache_path) if len(segment)]
+            stage.add(bytes_in=os.path.getsize(cache_path))
+        with report.stage('stats'):
+            stats = segments_stats(segments)
+        segments = [segment[:, :2] for segment in segments]
+        with report.stage('simplify'):
+            polylines = [segment_to_polyline(segment) for segment in segments]
+            lods = {
+                str(min_zoom): [segment_to_polyline(segment, tolerance) for segment in segments]
+                for min_zoom, tolerance in LOD_LEVELS
+            }
+        report.count('points_raw', sum(len(segment) for segment in segments))
+        report.count('points_simplified', sum(len(p) for p in polylines))
+        with report.stage('encode') as stage:
+            encoded = list(map(encode, polylines))
+            lods = {zoom: list(map(encode, lod)) for zoom, lod in lods.items()}
+            stage.add(bytes_out=sum(map(len, encoded)))
+        artifact = {
+            'polylines': encoded,
+            'lods': lods,
+            'points': [len(p) for p in polylines],
+            'bboxes': list(map(polyline_bbox, polylines)),
+            'first': [round(float(v), 5) for v in polylines[0][0]] if polylines else None,
+            'stats': stats,
+            'sha1': sha1,
+            'signature': geometry_signature(polylines),
+        }
+        artifacts.put(key, artifact)
+    return artifact
+
+
+def process_route(route, cache_paths, artifacts, report=None):
     result = dict(route)
-    for trace_url in route['traces']:
-        polylines = list(map(segment_to_polyline, chain.from_iterable(
-            map(extract_segments_from_gpx, get_gpxes(trace_url)))))
+    trace_artifacts = [process_trace(cache_path, artifacts, report) for cache_path in cache_paths]
+    polylines = [p for artifact in trace_artifacts for p in artifact['polylines']]
     print('Route {0} got {1} polylines, {2} points total'.format(
-        route['traces'][0], len(polylines), sum(len(p) for p in polylines)))
-    codec = PolylineCodec()
-    result['polylines'] = list(map(codec.encode, polylines))
+        route['name'], len(polylines), sum(sum(a['points']) for a in trace_artifacts)))
+    # Taken off the route by write_route, which stores each distinct trace once.
+    result['trace_geometry'] = [
+        {k: artifact[k] for k in ('sha1', 'signature', 'polylines', 'lods')}
+        for artifact in trace_artifacts
+    ]
+    if polylines:
+        result['bbox'] = merge_bboxes([b for artifact in trace_artifacts for b in artifact['bboxes']])
+        result['first'] = next(a['first'] for a in trace_artifacts if a['first'] is not None)
+        result['stats'] = merge_stats([artifact['stats'] for artifact in trace_artifacts])
+        result['cells'] = route_cells(list(map(decode, polylines)))
     return result
 
 
-def main():
-    result = {
-        'routes': []
-    }
-    input_data = read_json(os.path.join(exec_root, 'input.json'))
-    for route in input_data['routes']:
-        result['routes'].append(process_route(route))
-    bytes = write_json(os.path.join(exec_root, '../web/routes.json'), result, {
-        'ensure_ascii': False,
-    })
+def process_route_job(job):
+    """Runs process_route for (index, route, cache_paths, artifacts), catching
+    errors so that one broken route doesn't stop the build. Safe to run in a
+    worker process."""
+    index, route, cache_paths, artifacts = job
+    report = RunReport('process_route')
+    hits, misses = artifacts.hits, artifacts.misses
+    start = time.perf_counter()
+    try:
+        result, error = process_route(route, cache_paths, artifacts, report), None
+    except Exception:
+        result, error = None, traceback.format_exc()
+    report.item('routes', route['name'], time.perf_counter() - start)
+    report.count('artifact_hits', artifacts.hits - hits)
+    report.count('artifact_misses', artifacts.misses - misses)
+    return index, result, error, report.to_dict()
+
+
+def process_routes(jobs, workers):
+    """Yields the process_route_job results in the order of jobs, so that routes
+    can be written out as they come. Results that finish ahead of an earlier
+    route wait for it."""
+    if workers <= 1:
+        for job in jobs:
+            yield process_route_job(job)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(process_route_job, jobs):
+            yield result
+
+
+def write_route(route, writers, trace_table, entries, mapped_routes, cells, report):
+    """Hands a processed route to the routes, tile and binary writers, with its
+    traces replaced by their ids in trace_table. Keeps its index_entry in entries
+    and, if it's on the map, in mapped_routes and its route_cells in cells."""
+    traces = []
+    new_traces = []
+    for geometry in route.pop('trace_geometry'):
+        trace_id, new = trace_table.add(geometry['sha1'], geometry['signature'])
+        trace = {'id': trace_id, 'polylines': geometry['polylines'], 'lods': geometry['lods']}
+        traces.append(trace)
+        if new:
+            new_traces.append(trace)
+    route['trace_ids'] = [trace['id'] for trace in traces]
+    entry = index_entry(route)
+    entries.append(entry)
+    if 'bbox' in route:
+        mapped_routes.append(entry)
+        cells.append(entry.pop('cells'))
+    with report.stage('write_routes') as stage:
+        stage.add(bytes_out=writers[0].add(entry, new_traces))
+    if 'bbox' in route:
+        with report.stage('write_tiles'):
+            writers[1].add(route, traces)
+    if len(writers) > 2:
+        with report.stage('write_binary'):
+            writers[2].add([p for trace in traces for p in trace['polylines']])
+
+
+def publish(staged, writers, entries, mapped_routes, zooms, report):
+    """Finishes writers and writes the index, nearby.json and, with the binary
+    writer, its sidecar, appending the ones to commit to staged."""
+    with report.stage('write_routes') as stage:
+        bytes = writers[0].finish()
+        # The routes themselves were counted as they were added.
+        stage.add(bytes_out=bytes - stage.bytes_out)
     print('Wrote {0} routes. {1} bytes per route. {2} bytes total.'.format(
-        len(result['routes']), bytes / len(result['routes']), bytes))
+        len(entries), bytes / max(len(entries), 1), bytes))
+
+    if len(writers) > 2:
+        with report.stage('write_binary') as stage:
+            binary_bytes = writers[2].finish()
+            staged.extend(stage_meta(os.path.join(web_root, 'routes_meta.json'), entries))
+            stage.add(bytes_out=binary_bytes)
+        print('Wrote binary geometry. {0} bytes per route. {1} bytes total.'.format(
+            binary_bytes / max(len(entries), 1), binary_bytes))
+
+    with report.stage('write_tiles'):
+        tile_names = writers[1].finish()
+    if mapped_routes:
+        with report.stage('write_nearby') as stage:
+            nearby = stage_json(os.path.join(web_root, 'nearby.json'), {
+                'km': NEARBY_KM,
+                'routes': RouteIndex(mapped_routes).nearby(),
+            }, {})
+            staged.append(nearby)
+            stage.add(bytes_out=nearby.size)
+        print('Wrote nearby routes in {0} bytes.'.format(nearby.size))
+    with report.stage('write_index') as stage:
+        index = stage_json(os.path.join(web_root, 'routes_index.json'), {
+            'tile_zoom': TILE_ZOOM,
+            'tiles': tile_names,
+            'lod_zooms': zooms,
+            'routes': mapped_routes,
+        }, {
+            'ensure_ascii': False,
+        })
+        # Committed last, as the page loads everything else through it.
+        staged.append(index)
+        stage.add(bytes_out=index.size)
+    print('Wrote index of {0} routes in {1} bytes and {2} tiles.'.format(
+        len(mapped_routes), index.size, len(tile_names)))
+
+
+def report_near_duplicates(routes, cells, report):
+    """Prints the near_duplicates among routes, the mapped index entries."""
+    with report.stage('near_duplicates'):
+        duplicates = near_duplicates(routes, cells)
+    for i, j, share in duplicates:
+        if sorted(routes[i]['trace_ids']) == sorted(routes[j]['trace_ids']):
+            print('Routes {0} and {1} have the same traces'.format(
+                routes[i]['name'], routes[j]['name']))
+        else:
+            print('Route {0}: {1:.0%} of it is also on {2}'.format(
+                routes[i]['name'], share, routes[j]['name']))
+    report.count('near_duplicate_routes', len(duplicates))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Build web/routes.json from input.json.')
+    parser.add_argument('--revalidate', action='store_true',
+                        help='Send conditional requests for cached traces and '
+                             'download only the ones that changed.')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Ignore previously processed traces and process everything again.')
+    parser.add_argument('--download-workers', type=int, default=8,
+                        help='Number of concurrent trace downloads.')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='Number of worker processes for route processing.')
+    parser.add_argument('--store', metavar='PATH',
+                        help='Read routes from this SQLite route store instead of input.json.')
+    parser.add_argument('--run-report', metavar='PATH',
+                        help='Write stage timings, counters and the slowest routes to this '
+                             'JSON file.')
+    parser.add_argument('--profile', metavar='PATH',
+                        help='Run under cProfile and write the stats to this file. Only '
+                             'covers route processing with --jobs 1.')
+    parser.add_argument('--binary', action='store_true',
+                        help='Also write packed route geometry to web/routes.bin with a '
+                             'web/routes_meta.json sidecar, plus .gz/.br variants of both.')
+    parser.add_argument('--ndjson', action='store_true',
+                        help='Also write the routes to web/routes.ndjson, one JSON object '
+                             'per line.')
+    args = parser.parse_args()
+    if args.store and not os.path.exists(args.store):
+        parser.error('no route store at {0}'.format(args.store))
+    return args
+
+
+def main():
+    args = parse_args()
+    report = RunReport('preprocessor')
+    with profiled(args.profile):
+        failed = run(args, report)
+    report.print_summary()
+    if args.run_report:
+        report.write(args.run_report)
+    if failed:
+        sys.exit('{0} routes failed'.format(failed))
+
+
+def run(args, report):
+    if args.store:
+        input_data = read_store(args.store)
+    else:
+        input_data = read_json(os.path.join(exec_root, 'input.json'))
+    session = make_session(args.download_workers)
+    metadata = CacheMetadata(os.path.join(exec_root, 'cache'))
+    artifacts = ArtifactCache(os.path.join(exec_root, 'cache', 'artifacts'),
+                              enabled=not args.rebuild)
+    errors = {}
+    jobs = []
+    try:
+        traces = prefetch_traces([trace_url for route in input_data['routes']
+                                  for trace_url in route['traces']],
+                                 session, metadata, args.revalidate, args.download_workers,
+                                 report)
+    finally:
+        metadata.save()
+    for index, route in enumerate(input_data['routes']):
+        failed = [traces[trace_url][1] for trace_url in route['traces'] if traces[trace_url][1]]
+        if failed:
+            errors[index] = failed[0]
+            continue
+        jobs.append((index, route, [traces[trace_url][0] for trace_url in route['traces']],
+                     artifacts))
+    if args.revalidate:
+        print('{0} traces changed'.format(len(metadata.changed)))
+
+    zooms = lod_zooms(LOD_LEVELS, FULL_DETAIL_ZOOM)
+    routes_writer = StreamingRoutesWriter(
+        os.path.join(web_root, 'routes.json'),
+        os.path.join(web_root, 'routes.ndjson') if args.ndjson else None)
+    writers = [routes_writer, TileWriter(os.path.join(web_root, 'tiles'), zooms)]
+    if args.binary:
+        writers.append(BinaryRoutesWriter(os.path.join(web_root, 'routes.bin')))
+    # Only what the index needs is kept; the geometry goes straight to the writers.
+    entries = []
+    mapped_routes = []
+    cells = []
+    trace_table = TraceTable()
+    warnings = {}
+    try:
+        with report.stage('process'):
+            for index, route, error, route_report in process_routes(jobs, args.jobs):
+                report.merge(route_report)
+                if error is None:
+                    write_route(route, writers, trace_table, entries, mapped_routes, cells,
+                                report)
+                    if 'stats' in route:
+                        warnings[index] = check_stats(route, route['stats'])
+                else:
+                    errors[index] = error
+                print('[{0}/{1}] Processed {2}{3}'.format(
+                    len(entries) + len(errors), len(input_data['routes']),
+                    input_data['routes'][index]['name'], '' if error is None else ' (failed)'))
+    except BaseException:
+        for writer in writers:
+            writer.abort()
+        raise
+    print('Processed traces: {0} reused, {1} rebuilt'.format(
+        report.counters.get('artifact_hits', 0), report.counters.get('artifact_misses', 0)))
+    report.count('traces_distinct', trace_table.count)
+    report.count('traces_same_file', trace_table.same_file)
+    report.count('traces_same_geometry', trace_table.same_geometry)
+    print('Stored {0} distinct traces, {1} were the same file and {2} the same geometry '
+          'as another one'.format(trace_table.count, trace_table.same_file,
+                                  trace_table.same_geometry))
+
+    # Tiles and nearby.json refer to routes by their position in the index, so
+    # nothing is replaced unless every output was written. Failed routes are in
+    # none of them.
+    staged = list(writers)
+    try:
+        publish(staged, writers, entries, mapped_routes, zooms, report)
+    except BaseException:
+        for output in staged:
+            output.abort()
+        raise
+    for output in staged:
+        output.commit()
+    report_near_duplicates(mapped_routes, cells, report)
+    for index in sorted(warnings):
+        for warning in warnings[index]:
+            print('Route {0}: {1}'.format(input_data['routes'][index]['name'], warning))
+    for index in sorted(errors):
+        print('Failed to process route {0}:'.format(input_data['routes'][index]['name']))
+        print(errors[index])
+    report.count('routes', len(input_data['routes']))
+    report.count('routes_failed', len(errors))
+    return len(errors)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,117 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import main
+from artifacts import ArtifactCache
+
+GPX = b'''<?xml version="1.0"?>
+<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1">
+<trk>
+<trkseg></trkseg>
+<trkseg>
+<trkpt lat="42.0" lon="23.0"><ele>500</ele></trkpt>
+<trkpt lat="42.01" lon="23.01"><ele>510</ele></trkpt>
+</trkseg>
+</trk>
+</gpx>'''
+EMPTY_GPX = b'''<?xml version="1.0"?>
+<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1">
+<trk><trkseg></trkseg></trk>
+</gpx>'''
+
+
+class PreprocessorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.artifacts = ArtifactCache(os.path.join(self.dir, 'artifacts'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_gpx(self, name, content=GPX):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def process_trace(self, path):
+        # extract_segments prints every file it opens.
+        with contextlib.redirect_stdout(io.StringIO()):
+            return main.process_trace(path, self.artifacts)
+
+
+class ProcessTraceTests(PreprocessorTestCase):
+    def test_empty_segment(self):
+        artifact = self.process_trace(self.write_gpx('empty.gpx'))
+        self.assertEqual(len(artifact['polylines']), 1)
+        self.assertEqual(artifact['points'], [2])
+        self.assertEqual(artifact['bboxes'], [[42.0, 23.0, 42.01, 23.01]])
+        self.assertEqual(artifact['first'], [42.0, 23.0])
+
+    def test_only_empty_segments(self):
+        artifact = self.process_trace(self.write_gpx('empty.gpx', EMPTY_GPX))
+        self.assertEqual(artifact['polylines'], [])
+        self.assertIsNone(artifact['first'])
+
+
+def track(lat, lon):
+    """A GPX of one segment from (lat, lon) to 0.01 degrees north east of it."""
+    return '''<?xml version="1.0"?>
+<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1"><trk><trkseg>
+<trkpt lat="{0}" lon="{1}"></trkpt><trkpt lat="{2}" lon="{3}"></trkpt>
+</trkseg></trk></gpx>'''.format(lat, lon, lat + 0.01, lon + 0.01).encode('utf-8')
+
+
+class FakeResponse(object):
+    status_code = 200
+    headers = {}
+
+    def __init__(self, content):
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        yield self.content
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class FakeSession(object):
+    def __init__(self, files):
+        self.files = files
+
+    def get(self, url, headers=None, stream=False, timeout=None):
+        return FakeResponse(self.files[url])
+
+
+class ProcessRouteTests(PreprocessorTestCase):
+    def test_traces_with_the_same_file_name(self):
+        urls = ['http://mtb-bg.com/images/gpx/1/track.gpx',
+                'http://mtb-bg.com/images/gpx/2/track.gpx']
+        session = FakeSession({urls[0]: track(42.5, 23.5), urls[1]: track(42.0, 23.0)})
+        os.makedirs(os.path.join(self.dir, 'cache'))
+        with mock.patch.object(main, 'exec_root', self.dir), \
+                contextlib.redirect_stdout(io.StringIO()):
+            traces = main.prefetch_traces(urls, session, None, workers=2)
+            self.assertNotEqual(traces[urls[0]][0], traces[urls[1]][0])
+            route = main.process_route({'name': 'Route', 'traces': urls},
+                                       [traces[url][0] for url in urls], self.artifacts)
+        self.assertEqual([len(g['polylines']) for g in route['trace_geometry']], [1, 1])
+        self.assertNotEqual(route['trace_geometry'][0]['sha1'], route['trace_geometry'][1]['sha1'])
+        self.assertEqual(route['bbox'], [42.0, 23.0, 42.51, 23.51])
+        self.assertEqual(route['first'], [42.5, 23.5])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import numpy as np
+
+
+def round_half_away(values):
+    """Rounds like Python 2's round(), which the polyline algorithm is defined with."""
+    return np.copysign(np.floor(np.abs(values) + 0.5), values).astype(np.int64)
+
+
+def zigzag(values):
+    return np.where(values < 0, ~(values << 1), values << 1)
+
+
+def unzigzag(values):
+    return np.where(values & 1, ~(values >> 1), values >> 1)
+
+
+def split_chunks(values, bits, more_flag, offset):
+    """Splits non-negative integers into little-endian chunks of the given bit
+    size, flags every chunk but a value's last one with more_flag and adds offset.
+    Returns the chunks of all values in order as a uint8 array."""
+    max_chunks = max(1, (int(values.max()).bit_length() + bits - 1) // bits) if len(values) else 1
+    shifts = bits * np.arange(max_chunks, dtype=np.int64)
+    chunks = (values[:, np.newaxis] >> shifts) & ((1 << bits) - 1)
+    # Every value takes at least one chunk, plus one for each remaining non-zero bits.
+    lengths = 1 + np.count_nonzero((values[:, np.newaxis] >> shifts[1:]) != 0, axis=1)
+    positions = np.arange(max_chunks)
+    chunks = chunks + offset + np.where(positions < lengths[:, np.newaxis] - 1, more_flag, 0)
+    return chunks[positions < lengths[:, np.newaxis]].astype(np.uint8)
+
+
+def join_chunks(chunks, bits, more_flag):
+    """Inverse of split_chunks, for chunks with the offset already removed."""
+    chunks = chunks.astype(np.int64)
+    ends = (chunks & more_flag) == 0
+    groups = np.concatenate([[0], np.cumsum(ends)[:-1]])
+    starts = np.flatnonzero(np.concatenate([[True], ends[:-1]]))
+    positions = np.arange(len(chunks)) - starts[groups]
+    values = np.zeros(len(starts), dtype=np.int64)
+    np.add.at(values, groups, (chunks & ((1 << bits) - 1)) << (bits * positions))
+    return values
+
+
+def encode(coords, precision=5):
+    """Encodes an (N, 2) array of (latitude, longitude) pairs with Google's
+    polyline algorithm. The output is identical to polyline.codec.PolylineCodec,
+    but rounding, deltas, zig-zag and 5-bit chunking are computed over the whole
+    array at once."""
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if len(coords) == 0:
+        return ''
+    rounded = round_half_away(coords * int(10 ** precision))
+    deltas = np.diff(rounded, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    return split_chunks(zigzag(deltas), 5, 0x20, 63).tobytes().decode('ascii')
+
+
+def decode_ints(expression):
+    """Decodes a polyline into an (N, 2) int64 array of coordinates scaled by
+    10 ** precision, exactly as they were rounded when encoding."""
+    if not expression:
+        return np.zeros((0, 2), dtype=np.int64)
+    chunks = np.frombuffer(expression.encode('ascii'), dtype=np.uint8) - 63
+    deltas = unzigzag(join_chunks(chunks, 5, 0x20))
+    return np.cumsum(deltas.reshape(-1, 2), axis=0)
+
+
+def decode(expression, precision=5):
+    return decode_ints(expression) / float(10 ** precision)
@@ -0,0 +1,58 @@
+import random
+import unittest
+
+import numpy as np
+from polyline.codec import PolylineCodec
+
+import polyline_codec
+
+
+class EncodeTests(unittest.TestCase):
+    def assertSameAsCodec(self, coords):
+        self.assertEqual(polyline_codec.encode(np.array(coords)),
+                         PolylineCodec().encode([tuple(c) for c in coords]))
+
+    def test_reference_example(self):
+        coords = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+        self.assertEqual(polyline_codec.encode(coords), '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+
+    def test_single_point(self):
+        self.assertSameAsCodec([(42.69751, 23.32415)])
+
+    def test_empty(self):
+        self.assertEqual(polyline_codec.encode(np.zeros((0, 2))), '')
+
+    def test_half_rounding(self):
+        self.assertSameAsCodec([(0.000005, -0.000005), (0.000015, -0.000025), (0, 0)])
+
+    def test_random_tracks(self):
+        rnd = random.Random(42)
+        for _ in range(20):
+            lat, lon = rnd.uniform(-90, 90), rnd.uniform(-180, 180)
+            coords = []
+            for _ in range(rnd.randint(1, 300)):
+                lat += rnd.uniform(-0.5, 0.5) * rnd.choice([1e-4, 1e-2, 1])
+                lon += rnd.uniform(-0.5, 0.5) * rnd.choice([1e-4, 1e-2, 1])
+                coords.append((lat, lon))
+            self.assertSameAsCodec(coords)
+
+
+class DecodeTests(unittest.TestCase):
+    def test_reference_example(self):
+        np.testing.assert_array_equal(
+            polyline_codec.decode_ints('_p~iF~ps|U_ulLnnqC_mqNvxq`@'),
+            [[3850000, -12020000], [4070000, -12095000], [4325200, -12645300]])
+
+    def test_empty(self):
+        self.assertEqual(polyline_codec.decode_ints('').shape, (0, 2))
+
+    def test_round_trip(self):
+        rnd = random.Random(7)
+        coords = np.array([(rnd.uniform(-90, 90), rnd.uniform(-180, 180)) for _ in range(500)])
+        encoded = polyline_codec.encode(coords)
+        self.assertEqual(list(map(tuple, polyline_codec.decode(encoded).tolist())),
+                         PolylineCodec().decode(encoded))
+
+
+if __name__ == '__main__':
+    unittest.main()
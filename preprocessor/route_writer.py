@@ -0,0 +1,114 @@
+"""Writes routes.json a route at a time, so the built routes never have to be in
+memory all at once, optionally with an NDJSON copy of one route or trace per
+line.
+
+Everything goes through temp files next to the targets, which only replace them
+once the whole file is written. A build that dies half way leaves the previous
+files being served. The writers and StagedFile can also be finished first and
+committed later, so that a set of outputs is only replaced once all of them are
+written."""
+import os
+import shutil
+import tempfile
+
+import simplejson
+
+import shared  # noqa: F401
+from utils import commit_temp, discard_temp, open_temp
+
+
+class StagedFile(object):
+    """data written to a temp file next to path, which only replaces path on
+    commit(); abort() drops it."""
+
+    def __init__(self, path, data):
+        self.path = path
+        self.size = len(data)
+        self.tmp_path, f = open_temp(path)
+        try:
+            with f:
+                f.write(data)
+        except BaseException:
+            self.abort()
+            raise
+
+    def commit(self):
+        commit_temp(self.tmp_path, self.path)
+
+    def abort(self):
+        discard_temp(self.tmp_path)
+
+
+def stage_json(path, data, dumps_params):
+    return StagedFile(path, simplejson.dumps(data, **dumps_params).encode('utf-8'))
+
+
+class StreamingRoutesWriter(object):
+    """Writes {"routes": [...], "traces": [...]} to path as routes are added, with
+    each trace, shared between routes, stored once. With ndjson_path, the same
+    traces and routes also go there one per line, every trace before the first
+    route that refers to it. Nothing replaces the targets until close(), or
+    finish() and then commit(); abort() drops the temp files."""
+
+    def __init__(self, path, ndjson_path=None):
+        self.count = 0
+        self.trace_count = 0
+        self.size = 0
+        self.outputs = [(path,) + open_temp(path)]
+        if ndjson_path:
+            self.outputs.append((ndjson_path,) + open_temp(ndjson_path))
+        # The traces come after all routes in routes.json, so they wait here.
+        self.traces = tempfile.TemporaryFile(dir=os.path.dirname(path) or '.')
+        self._write(0, b'{"routes": [')
+
+    def _write(self, output, data):
+        self.outputs[output][2].write(data)
+        if output == 0:
+            self.size += len(data)
+
+    def add(self, route, traces=()):
+        """Writes route out along with traces, the ones it refers to by id that
+        weren't written before. Returns the number of bytes they took in
+        routes.json."""
+        size = self.size
+        for trace in traces:
+            value = simplejson.dumps(trace, ensure_ascii=False).encode('utf-8')
+            self.traces.write((b', ' if self.trace_count else b'') + value)
+            self.size += len(value) + (2 if self.trace_count else 0)
+            if len(self.outputs) > 1:
+                self._write(1, value + b'\n')
+            self.trace_count += 1
+        value = simplejson.dumps(route, ensure_ascii=False).encode('utf-8')
+        self._write(0, (b', ' if self.count else b'') + value)
+        if len(self.outputs) > 1:
+            self._write(1, value + b'\n')
+        self.count += 1
+        return self.size - size
+
+    def close(self):
+        """Finishes the files and puts them in place. Returns the size of routes.json."""
+        size = self.finish()
+        self.commit()
+        return size
+
+    def finish(self):
+        """Finishes the temp files. Returns the size of routes.json."""
+        self._write(0, b'], "traces": [')
+        # Already counted in size as the traces were added.
+        self.traces.seek(0)
+        shutil.copyfileobj(self.traces, self.outputs[0][2])
+        self.traces.close()
+        self._write(0, b']}')
+        for path, tmp_path, f in self.outputs:
+            f.close()
+        return self.size
+
+    def commit(self):
+        for path, tmp_path, f in self.outputs:
+            commit_temp(tmp_path, path)
+
+    def abort(self):
+        self.traces.close()
+        for path, tmp_path, f in self.outputs:
+            f.close()
+            discard_temp(tmp_path)
@@ -0,0 +1,135 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import simplejson
+
+from route_writer import StagedFile, StreamingRoutesWriter
+from tiles import TileWriter
+from utils import UMASK
+
+TRACES = [
+    {'id': 0, 'polylines': ['_p~iF~ps|U'], 'lods': {'9': ['_p~iF']}},
+    {'id': 1, 'polylines': ['_ulLnnqC'], 'lods': {'9': ['_ulL']}},
+]
+ROUTES = [
+    {'name': 'Витоша', 'trace_ids': [0], 'bbox': [42.56, 23.28, 42.6, 23.3]},
+    {'name': 'Plovdiv', 'trace_ids': []},
+    {'name': 'Sofia', 'trace_ids': [1, 0], 'bbox': [42.69, 23.32, 42.7, 23.33]},
+]
+
+
+def read(path):
+    with io.open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+class StreamingRoutesWriterTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'routes.json')
+        self.ndjson_path = os.path.join(self.dir, 'routes.ndjson')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_same_as_dumping_everything(self):
+        writer = StreamingRoutesWriter(self.path, self.ndjson_path)
+        writer.add(ROUTES[0], TRACES[:1])
+        writer.add(ROUTES[1])
+        writer.add(ROUTES[2], TRACES[1:])
+        size = writer.close()
+        expected = simplejson.dumps({'routes': ROUTES, 'traces': TRACES}, ensure_ascii=False)
+        self.assertEqual(read(self.path), expected)
+        self.assertEqual(size, len(expected.encode('utf-8')))
+        self.assertEqual([simplejson.loads(line) for line in read(self.ndjson_path).splitlines()],
+                         [TRACES[0], ROUTES[0], ROUTES[1], TRACES[1], ROUTES[2]])
+        self.assertEqual(sorted(os.listdir(self.dir)), ['routes.json', 'routes.ndjson'])
+
+    def test_empty(self):
+        StreamingRoutesWriter(self.path).close()
+        self.assertEqual(simplejson.loads(read(self.path)), {'routes': [], 'traces': []})
+
+    def test_finish_then_commit(self):
+        with open(self.path, 'w') as f:
+            f.write('{"routes": []}')
+        writer = StreamingRoutesWriter(self.path)
+        writer.add(ROUTES[1])
+        writer.finish()
+        self.assertEqual(read(self.path), '{"routes": []}')
+        writer.commit()
+        self.assertEqual(simplejson.loads(read(self.path)), {'routes': [ROUTES[1]], 'traces': []})
+        self.assertEqual(os.listdir(self.dir), ['routes.json'])
+
+    def test_keeps_mode_of_replaced_file(self):
+        StreamingRoutesWriter(self.path).close()
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o666 & ~UMASK)
+        os.chmod(self.path, 0o640)
+        StreamingRoutesWriter(self.path).close()
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o640)
+
+    def test_staged_file(self):
+        staged = StagedFile(self.path, b'{}')
+        self.assertFalse(os.path.exists(self.path))
+        staged.commit()
+        self.assertEqual(read(self.path), '{}')
+        StagedFile(self.path, b'[]').abort()
+        self.assertEqual(read(self.path), '{}')
+        self.assertEqual(os.listdir(self.dir), ['routes.json'])
+
+    def test_abort_keeps_previous_file(self):
+        with open(self.path, 'w') as f:
+            f.write('{"routes": []}')
+        writer = StreamingRoutesWriter(self.path)
+        writer.add(ROUTES[0], TRACES[:1])
+        self.assertEqual(read(self.path), '{"routes": []}')
+        writer.abort()
+        self.assertEqual(read(self.path), '{"routes": []}')
+        self.assertEqual(os.listdir(self.dir), ['routes.json'])
+
+
+class TileWriterTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.tiles_dir = os.path.join(self.dir, 'tiles')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_tiles(self):
+        os.makedirs(os.path.join(self.tiles_dir, 'stale'))
+        writer = TileWriter(self.tiles_dir, [9, 13])
+        writer.add(ROUTES[0], TRACES[:1])
+        writer.add(ROUTES[2], TRACES[::-1])
+        self.assertEqual(writer.close(), ['9/289/188'])
+        self.assertEqual(sorted(os.listdir(self.tiles_dir)), ['13', '9'])
+        self.assertEqual(simplejson.loads(read(os.path.join(self.tiles_dir, '9/9/289/188.json'))), {
+            'routes': [{'id': 0, 'trace_ids': [0]}, {'id': 1, 'trace_ids': [1, 0]}],
+            'traces': {'0': ['_p~iF'], '1': ['_ulL']},
+        })
+        self.assertEqual(simplejson.loads(read(os.path.join(self.tiles_dir, '13/9/289/188.json')))[
+            'traces'], {'0': TRACES[0]['polylines'], '1': TRACES[1]['polylines']})
+        self.assertEqual(os.listdir(self.dir), ['tiles'])
+        self.assertEqual(os.stat(self.tiles_dir).st_mode & 0o777, 0o777 & ~UMASK)
+
+    def test_abort(self):
+        writer = TileWriter(self.tiles_dir, [9])
+        writer.add(ROUTES[0], TRACES[:1])
+        writer.abort()
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_abort_after_finish(self):
+        os.makedirs(os.path.join(self.tiles_dir, 'stale'))
+        writer = TileWriter(self.tiles_dir, [9])
+        writer.add(ROUTES[0], TRACES[:1])
+        self.assertEqual(writer.finish(), ['9/289/188'])
+        self.assertEqual(os.listdir(self.tiles_dir), ['stale'])
+        writer.abort()
+        self.assertEqual(os.listdir(self.dir), ['tiles'])
+        self.assertEqual(os.listdir(self.tiles_dir), ['stale'])
+
+
+if __name__ == '__main__':
+    unittest.main()
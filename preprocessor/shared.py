@@ -0,0 +1,9 @@
+"""Makes the modules preprocessor shares with mtbbg, like instrument and fetcher,
+importable. Import it before any of them; preprocessor's own modules still come
+first."""
+import os
+import sys
+
+mtbbg_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mtbbg')
+if mtbbg_root not in sys.path:
+    sys.path.append(mtbbg_root)
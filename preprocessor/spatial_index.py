@@ -0,0 +1,106 @@
+"""Spatial queries over the routes in routes_index.json, without touching their
+geometry.
+
+    python spatial_index.py near 42.69 23.32 --km 20
+    python spatial_index.py bbox 42.5 23.1 42.8 23.5
+"""
+import argparse
+import math
+import os
+import time
+
+import numpy as np
+import simplejson
+from shapely import STRtree, box, points
+
+from trace_stats import EARTH_RADIUS
+
+web_root = os.path.join(os.path.dirname(__file__), '..', 'web')
+NEARBY_KM = 20
+NEARBY_LIMIT = 10
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Distances in km from (lat, lon) to every point of the lats/lons arrays."""
+    lat, lon, lats, lons = map(np.radians, (lat, lon, lats, lons))
+    a = (np.sin((lats - lat) / 2) ** 2 +
+         np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2)
+    return 2 * EARTH_RADIUS / 1000.0 * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class RouteIndex(object):
+    """R-trees over the bounding boxes and start points of routes, as written to
+    routes_index.json. Query results are positions in routes."""
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.starts = np.array([route['first'] for route in routes],
+                               dtype=np.float64).reshape(-1, 2)
+        # Shapely geometries are (x, y), so longitude first.
+        self.start_tree = STRtree(points(self.starts[:, ::-1]))
+        self.bbox_tree = STRtree([box(r['bbox'][1], r['bbox'][0], r['bbox'][3], r['bbox'][2])
+                                  for r in routes])
+
+    def near(self, lat, lon, km):
+        """Returns (position, distance in km) of the routes starting within km of
+        (lat, lon), closest first."""
+        # A degree of latitude is ~111 km, one of longitude shrinks with cos(lat).
+        dlat = km / 111.0
+        dlon = km / (111.0 * max(math.cos(math.radians(lat)), 0.01))
+        candidates = self.start_tree.query(box(lon - dlon, lat - dlat, lon + dlon, lat + dlat))
+        distances = haversine_km(lat, lon, self.starts[candidates, 0], self.starts[candidates, 1])
+        order = np.argsort(distances, kind='stable')
+        return [(int(candidates[i]), float(distances[i])) for i in order if distances[i] <= km]
+
+    def intersecting(self, min_lat, min_lon, max_lat, max_lon):
+        """Returns the positions of the routes whose bounding box intersects the
+        given one, in order."""
+        return sorted(int(i) for i in self.bbox_tree.query(box(min_lon, min_lat, max_lon, max_lat)))
+
+    def nearby(self, km=NEARBY_KM, limit=NEARBY_LIMIT):
+        """For every route, [position, distance in km] of up to limit other routes
+        starting within km of its start, closest first."""
+        result = []
+        for position, (lat, lon) in enumerate(self.starts):
+            result.append([
+                [other, round(distance, 1)]
+                for other, distance in self.near(lat, lon, km) if other != position
+            ][:limit])
+        return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Query the routes in web/routes_index.json.')
+    parser.add_argument('--index', default=os.path.join(web_root, 'routes_index.json'))
+    commands = parser.add_subparsers(dest='command', required=True)
+    near = commands.add_parser('near', help='Routes starting near a point.')
+    near.add_argument('lat', type=float)
+    near.add_argument('lon', type=float)
+    near.add_argument('--km', type=float, default=NEARBY_KM)
+    bbox = commands.add_parser('bbox', help='Routes intersecting a bounding box.')
+    for name in ('min_lat', 'min_lon', 'max_lat', 'max_lon'):
+        bbox.add_argument(name, type=float)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    with open(args.index, 'r') as f:
+        routes = simplejson.loads(f.read())['routes']
+    index = RouteIndex(routes)
+    start = time.perf_counter()
+    if args.command == 'near':
+        results = index.near(args.lat, args.lon, args.km)
+    else:
+        results = [(i, None) for i in index.intersecting(
+            args.min_lat, args.min_lon, args.max_lat, args.max_lon)]
+    elapsed = time.perf_counter() - start
+    for position, distance in results:
+        route = routes[position]
+        prefix = '' if distance is None else '{0:6.1f} km  '.format(distance)
+        print('{0}{1}  {2}'.format(prefix, route['name'], route.get('link', '')))
+    print('{0} routes in {1:.3f} ms'.format(len(results), elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
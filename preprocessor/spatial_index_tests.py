@@ -0,0 +1,37 @@
+import unittest
+
+from spatial_index import RouteIndex, haversine_km
+
+
+def route(name, lat, lon, size=0.01):
+    return {'name': name, 'first': [lat, lon], 'bbox': [lat, lon, lat + size, lon + size]}
+
+
+class RouteIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.index = RouteIndex([
+            route('Sofia', 42.69, 23.32),
+            route('Vitosha', 42.56, 23.28, 0.1),
+            route('Plovdiv', 42.14, 24.75),
+        ])
+
+    def test_haversine_km(self):
+        self.assertAlmostEqual(float(haversine_km(42.0, 23.0, 43.0, 23.0)), 111.2, 1)
+
+    def test_near(self):
+        near = self.index.near(42.69, 23.32, 20)
+        self.assertEqual([position for position, _ in near], [0, 1])
+        self.assertAlmostEqual(near[1][1], 14.8, 0)
+        self.assertEqual(self.index.near(42.69, 23.32, 1), [(0, 0.0)])
+
+    def test_intersecting(self):
+        self.assertEqual(self.index.intersecting(42.6, 23.3, 42.7, 23.35), [0, 1])
+        self.assertEqual(self.index.intersecting(42.0, 24.0, 42.5, 25.0), [2])
+        self.assertEqual(self.index.intersecting(40.0, 20.0, 40.1, 20.1), [])
+
+    def test_nearby(self):
+        self.assertEqual(self.index.nearby(km=20), [[[1, 14.8]], [[0, 14.8]], []])
+
+
+if __name__ == '__main__':
+    unittest.main()
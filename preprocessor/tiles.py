@@ -0,0 +1,136 @@
+import io
+import math
+import os
+import shutil
+import tempfile
+
+import simplejson
+
+import shared  # noqa: F401
+from utils import target_mode
+
+# Tracks are only drawn from zoom 9 on, so that's the only level tiles are cut at.
+TILE_ZOOM = 9
+
+
+def tile_for(lat, lon, zoom):
+    """Returns the (x, y) of the slippy map tile containing the point."""
+    n = 2 ** zoom
+    lat_rad = math.radians(max(-85.0511, min(85.0511, lat)))
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.log(math.tan(lat_rad) + 1.0 / math.cos(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tiles_for_bbox(bbox, zoom):
+    """Yields the (x, y) of every tile intersecting a (min_lat, min_lon, max_lat,
+    max_lon) bounding box."""
+    min_x, min_y = tile_for(bbox[2], bbox[1], zoom)
+    max_x, max_y = tile_for(bbox[0], bbox[3], zoom)
+    for x in range(min_x, max_x + 1):
+        for y in range(min_y, max_y + 1):
+            yield x, y
+
+
+def index_entry(route):
+    """Everything the map needs to place and describe a route, without geometry."""
+    return {k: v for k, v in route.items() if k not in ('polylines', 'lods')}
+
+
+def lod_zooms(lod_levels, full_detail_zoom):
+    return [min_zoom for min_zoom, _ in lod_levels] + [full_detail_zoom]
+
+
+def lod_polylines(trace, min_zoom):
+    """The polylines of a trace at the level of detail starting at min_zoom. The
+    finest level is the trace's own polylines."""
+    return trace.get('lods', {}).get(str(min_zoom), trace['polylines'])
+
+
+class TileWriter(object):
+    """Writes tiles_dir/lod/zoom/x/y.json shards with every added route whose
+    bounding box intersects the tile, once for each level of detail in zooms.
+    Routes are referred to by the order they were added in and list their
+    trace_ids. The polylines of each trace are in the tile once, under its id,
+    however many of its routes are in the tile.
+
+    Each route is appended to per tile spill files as it's added, so only one tile
+    is ever in memory. The tiles are built in a temp dir that replaces tiles_dir
+    on close(), or finish() and then commit(); abort() drops it."""
+
+    def __init__(self, tiles_dir, zooms, zoom=TILE_ZOOM):
+        self.tiles_dir = tiles_dir
+        self.zooms = zooms
+        self.zoom = zoom
+        self.count = 0
+        # (x, y) -> ids of the traces already in the tile.
+        self.tiles = {}
+        self.tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(tiles_dir)),
+                                        prefix='.tiles-')
+
+    def _spill_path(self, lod, x, y, kind):
+        return os.path.join(self.tmp_dir, str(lod), str(self.zoom), str(x),
+                            '{0}.{1}.ndjson'.format(y, kind))
+
+    def _append(self, path, line):
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with io.open(path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+    def add(self, route, traces):
+        """Adds route, with a bbox and trace_ids, whose traces are the dicts with the
+        id, polylines and lods of each of its traces."""
+        route_id = self.count
+        self.count += 1
+        for x, y in tiles_for_bbox(route['bbox'], self.zoom):
+            seen = self.tiles.setdefault((x, y), set())
+            new_traces = [t for t in traces if t['id'] not in seen]
+            seen.update(t['id'] for t in new_traces)
+            for lod in self.zooms:
+                self._append(self._spill_path(lod, x, y, 'routes'), simplejson.dumps(
+                    {'id': route_id, 'trace_ids': route['trace_ids']}))
+                for trace in new_traces:
+                    # A member of the "traces" object, for close() to join.
+                    self._append(self._spill_path(lod, x, y, 'traces'), '"{0}": {1}'.format(
+                        trace['id'], simplejson.dumps(lod_polylines(trace, lod),
+                                                      ensure_ascii=False)))
+
+    def close(self):
+        """Turns the spill files into tiles and puts them in place. Returns the names
+        of the written tiles as "z/x/y"."""
+        names = self.finish()
+        self.commit()
+        return names
+
+    def finish(self):
+        """Turns the spill files into tiles in the temp dir. Returns the names of the
+        written tiles as "z/x/y"."""
+        for lod in self.zooms:
+            for x, y in self.tiles:
+                parts = {}
+                for kind in ('routes', 'traces'):
+                    path = self._spill_path(lod, x, y, kind)
+                    with io.open(path, 'r', encoding='utf-8') as f:
+                        parts[kind] = ', '.join(f.read().splitlines())
+                    os.unlink(path)
+                path = os.path.join(self.tmp_dir, str(lod), str(self.zoom), str(x),
+                                    '{0}.json'.format(y))
+                with io.open(path, 'w', encoding='utf-8') as f:
+                    f.write('{"routes": [' + parts['routes'] + '], "traces": {' +
+                            parts['traces'] + '}}')
+        # mkdtemp creates the dir private.
+        os.chmod(self.tmp_dir, target_mode(self.tiles_dir, directory=True))
+        return ['{0}/{1}/{2}'.format(self.zoom, x, y) for x, y in sorted(self.tiles)]
+
+    def commit(self):
+        old_dir = None
+        if os.path.exists(self.tiles_dir):
+            old_dir = self.tmp_dir + '.old'
+            os.rename(self.tiles_dir, old_dir)
+        os.rename(self.tmp_dir, self.tiles_dir)
+        if old_dir:
+            shutil.rmtree(old_dir)
+
+    def abort(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
@@ -0,0 +1,117 @@
+"""Finds traces shared between routes, and routes that mostly follow each other.
+
+Traces are fingerprinted twice. The file hash catches the same GPX linked from
+several articles. The geometry signature, a hash of the simplified coordinates
+on a SIGNATURE_PRECISION grid, also catches the same track exported or zipped
+again. Traces with either fingerprint in common are stored once.
+
+Routes that don't share traces but still mostly overlap, such as a part of a
+"сборна следа", are found by comparing the grid cells their traces pass through.
+"""
+import hashlib
+import struct
+
+import numpy as np
+
+from spatial_index import RouteIndex
+
+# Decimal places of the signature grid, about 10 m.
+SIGNATURE_PRECISION = 4
+# Degrees, about 100 m of latitude.
+CELL_SIZE = 0.001
+# Share of the smaller route's cells that have to be on the other one.
+NEAR_DUPLICATE_OVERLAP = 0.9
+
+
+def geometry_signature(polylines):
+    """Hash of (N, 2) lat/lon arrays rounded to SIGNATURE_PRECISION decimals."""
+    h = hashlib.sha1()
+    for polyline in polylines:
+        quantised = np.round(np.asarray(polyline, dtype=np.float64) *
+                             10 ** SIGNATURE_PRECISION).astype(np.int64)
+        h.update(struct.pack('<Q', len(quantised)))
+        h.update(quantised.tobytes())
+    return h.hexdigest()
+
+
+def route_cells(polylines, cell=CELL_SIZE):
+    """Sorted ids of the grid cells that (N, 2) lat/lon arrays pass through. Lines
+    are sampled every half cell, so that long simplified edges count for every
+    cell they cross."""
+    samples = []
+    for polyline in polylines:
+        polyline = np.asarray(polyline, dtype=np.float64).reshape(-1, 2)
+        if len(polyline) > 1:
+            deltas = np.diff(polyline, axis=0)
+            steps = np.maximum(np.ceil(np.abs(deltas).max(axis=1) / (cell / 2)), 1).astype(np.int64)
+            offsets = np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)
+            samples.append(np.repeat(polyline[:-1], steps, axis=0) +
+                           np.repeat(deltas / steps[:, None], steps, axis=0) * offsets[:, None])
+        samples.append(polyline[-1:])
+    if not samples:
+        return np.zeros(0, dtype=np.int64)
+    cells = np.floor(np.concatenate(samples) / cell).astype(np.int64)
+    return np.unique(cells[:, 0] * (1 << 32) + cells[:, 1])
+
+
+class TraceTable(object):
+    """Gives every distinct trace an id, in the order they're first seen, going by
+    their file hash and geometry signature."""
+
+    def __init__(self):
+        self.by_sha1 = {}
+        self.by_signature = {}
+        self.count = 0
+        self.same_file = 0
+        self.same_geometry = 0
+
+    def add(self, sha1, signature):
+        """Returns (id, whether the trace wasn't seen before)."""
+        trace_id = self.by_sha1.get(sha1)
+        if trace_id is not None:
+            self.same_file += 1
+            return trace_id, False
+        trace_id = self.by_signature.get(signature)
+        if trace_id is not None:
+            self.same_geometry += 1
+            self.by_sha1[sha1] = trace_id
+            return trace_id, False
+        trace_id = self.count
+        self.count += 1
+        self.by_sha1[sha1] = trace_id
+        self.by_signature[signature] = trace_id
+        return trace_id, True
+
+
+def near_cells(cells, other):
+    """Whether each of cells is in other or next to one of its cells, so that tracks
+    running along a cell border still match."""
+    found = np.zeros(len(cells), dtype=bool)
+    for dlat in (-1, 0, 1):
+        for dlon in (-1, 0, 1):
+            found |= np.isin(cells + dlat * (1 << 32) + dlon, other, assume_unique=True)
+    return found
+
+
+def near_duplicates(routes, cells, overlap=NEAR_DUPLICATE_OVERLAP):
+    """Returns (position, other position, share) for routes, index entries with a
+    bbox, where share of the cells of the route at position, the one with fewer
+    cells, are near_cells of the other one and share >= overlap. cells are the
+    route_cells of each route."""
+    if not routes:
+        return []
+    index = RouteIndex(routes)
+    result = []
+    for i, route in enumerate(routes):
+        min_lat, min_lon, max_lat, max_lon = route['bbox']
+        for j in index.intersecting(min_lat - CELL_SIZE, min_lon - CELL_SIZE,
+                                    max_lat + CELL_SIZE, max_lon + CELL_SIZE):
+            if j <= i:
+                continue
+            small, large = (i, j) if len(cells[i]) <= len(cells[j]) else (j, i)
+            if not len(cells[small]):
+                continue
+            share = np.mean(near_cells(cells[small], cells[large]))
+            if share >= overlap:
+                result.append((small, large, float(share)))
+    return result
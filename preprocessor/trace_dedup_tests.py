@@ -0,0 +1,57 @@
+import unittest
+
+import numpy as np
+
+from trace_dedup import TraceTable, geometry_signature, near_duplicates, route_cells
+
+
+def line(lat, lon, lat2, lon2, points=50):
+    return np.column_stack([np.linspace(lat, lat2, points), np.linspace(lon, lon2, points)])
+
+
+def entry(name, polylines, trace_ids):
+    points = np.concatenate(polylines)
+    return {'name': name, 'trace_ids': trace_ids, 'first': list(points[0]),
+            'bbox': list(points.min(axis=0)) + list(points.max(axis=0))}
+
+
+class TraceDedupTests(unittest.TestCase):
+    def test_geometry_signature(self):
+        trace = [line(42.0, 23.0, 42.1, 23.1)]
+        self.assertEqual(geometry_signature(trace), geometry_signature([trace[0] + 0.000001]))
+        self.assertNotEqual(geometry_signature(trace), geometry_signature([trace[0] + 0.001]))
+        self.assertNotEqual(geometry_signature(trace),
+                            geometry_signature([trace[0][:25], trace[0][25:]]))
+
+    def test_route_cells(self):
+        # A single long edge still counts for every cell along it.
+        self.assertEqual(len(route_cells([line(42.0, 23.0, 42.0, 23.01, 2)])), 11)
+        self.assertEqual(len(route_cells([line(42.0005, 23.0005, 42.0005, 23.0005, 1)])), 1)
+        self.assertEqual(len(route_cells([])), 0)
+
+    def test_trace_table(self):
+        table = TraceTable()
+        self.assertEqual(table.add('a', 'x'), (0, True))
+        self.assertEqual(table.add('b', 'y'), (1, True))
+        self.assertEqual(table.add('a', 'x'), (0, False))
+        self.assertEqual(table.add('c', 'y'), (1, False))
+        self.assertEqual(table.add('c', 'z'), (1, False))
+        self.assertEqual((table.count, table.same_file, table.same_geometry), (2, 2, 1))
+
+    def test_near_duplicates(self):
+        north = [line(42.0, 23.0, 42.1, 23.0)]
+        south = [line(41.9, 23.0, 42.0, 23.0)]
+        both = north + south
+        elsewhere = [line(43.0, 25.0, 43.1, 25.1)]
+        routes = [entry('north', north, [0]), entry('both', both, [1]),
+                  entry('elsewhere', elsewhere, [2]), entry('shifted', [north[0] + 0.0002], [3])]
+        cells = [route_cells(polylines) for polylines in (north, both, elsewhere,
+                                                          [north[0] + 0.0002])]
+        duplicates = near_duplicates(routes, cells)
+        self.assertEqual([(i, j) for i, j, _ in duplicates], [(0, 1), (0, 3), (3, 1)])
+        self.assertEqual(duplicates[0][2], 1.0)
+        self.assertEqual(near_duplicates([], []), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import numpy as np
+
+EARTH_RADIUS = 6371008.8
+# GPS elevations jitter by a few meters from point to point, which adds up to
+# hundreds of meters of phantom climbing over a long track. A moving average
+# over this many points evens most of it out.
+ELEVATION_SMOOTHING = 5
+# How far the measured distance and ascent can be from the scraped length and
+# ascent before check_stats complains.
+DISTANCE_TOLERANCE = 0.25
+ASCENT_TOLERANCE = 0.5
+
+
+def distance(segment):
+    """Length in meters of an (N, 2+) array of (latitude, longitude, ...) points,
+    by the haversine formula."""
+    if len(segment) < 2:
+        return 0.0
+    lat = np.radians(segment[:, 0])
+    lon = np.radians(segment[:, 1])
+    a = (np.sin(np.diff(lat) / 2) ** 2 +
+         np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2)
+    return float(2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0))).sum())
+
+
+def climb(elevations):
+    """Returns the total (ascent, descent) in meters along elevations, skipping
+    points without one (NaN)."""
+    elevations = elevations[~np.isnan(elevations)]
+    if len(elevations) > ELEVATION_SMOOTHING:
+        window = np.ones(ELEVATION_SMOOTHING) / ELEVATION_SMOOTHING
+        elevations = np.convolve(elevations, window, mode='valid')
+    deltas = np.diff(elevations)
+    return float(deltas[deltas > 0].sum()), float(-deltas[deltas < 0].sum())
+
+
+def segments_stats(segments):
+    """Measured statistics of a trace, from its (N, 3) segments of (latitude,
+    longitude, elevation)."""
+    ascent = descent = 0.0
+    for segment in segments:
+        segment_ascent, segment_descent = climb(segment[:, 2])
+        ascent += segment_ascent
+        descent += segment_descent
+    return {
+        'distance': round(sum(map(distance, segments)) / 1000.0, 2),
+        'ascent': int(round(ascent)),
+        'descent': int(round(descent)),
+        'points': sum(len(segment) for segment in segments),
+    }
+
+
+def merge_stats(stats):
+    """Sums the statistics of several traces."""
+    return {
+        'distance': round(sum(s['distance'] for s in stats), 2),
+        'ascent': sum(s['ascent'] for s in stats),
+        'descent': sum(s['descent'] for s in stats),
+        'points': sum(s['points'] for s in stats),
+    }
+
+
+def check_stats(route, stats):
+    """Returns warnings about where the route's scraped length and ascent disagree
+    with the measured stats."""
+    warnings = []
+    length = route.get('length')
+    if length and stats['distance'] and \
+            abs(stats['distance'] - float(length)) > DISTANCE_TOLERANCE * float(length):
+        warnings.append('length is {0} km, the traces measure {1} km'.format(
+            length, stats['distance']))
+    ascent = route.get('ascent')
+    # Negative ascents are scraped descents.
+    if ascent and ascent > 0 and stats['ascent'] and \
+            abs(stats['ascent'] - float(ascent)) > ASCENT_TOLERANCE * float(ascent):
+        warnings.append('ascent is {0} m, the traces measure {1} m'.format(
+            ascent, stats['ascent']))
+    return warnings
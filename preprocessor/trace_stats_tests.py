@@ -0,0 +1,67 @@
+import io
+import unittest
+from decimal import Decimal
+
+import numpy as np
+
+from gpx_stream import iter_segments
+from trace_stats import check_stats, climb, distance, segments_stats
+
+GPX = b'''<?xml version="1.0"?>
+<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1">
+<wpt lat="1" lon="1"><ele>5000</ele></wpt>
+<trk><trkseg>
+<trkpt lat="42.0" lon="23.0"><ele>500</ele></trkpt>
+<trkpt lat="42.01" lon="23.0"></trkpt>
+<trkpt lat="42.02" lon="23.0"><ele>520.5</ele></trkpt>
+</trkseg></trk>
+</gpx>'''
+
+
+WAYPOINT_GPX = b'''<?xml version="1.0"?>
+<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1">
+<wpt lat="1" lon="1"><ele>5000</ele></wpt>
+<trk><trkseg>
+<trkpt lat="42.0" lon="23.0"></trkpt>
+<trkpt lat="42.01" lon="23.0"><ele>510</ele></trkpt>
+</trkseg></trk>
+<rte><rtept lat="1" lon="1"><ele>6000</ele></rtept></rte>
+</gpx>'''
+
+
+class TraceStatsTests(unittest.TestCase):
+    def test_iter_segments_elevations(self):
+        segment, = iter_segments(io.BytesIO(GPX))
+        self.assertEqual(segment.shape, (3, 3))
+        self.assertEqual(segment[0, 2], 500)
+        self.assertTrue(np.isnan(segment[1, 2]))
+        self.assertEqual(segment[2, 2], 520.5)
+
+    def test_iter_segments_ignores_waypoint_elevations(self):
+        segment, = iter_segments(io.BytesIO(WAYPOINT_GPX))
+        self.assertTrue(np.isnan(segment[0, 2]))
+        self.assertEqual(segment[1, 2], 510)
+
+    def test_distance(self):
+        # One degree of latitude is about 111.2 km.
+        self.assertAlmostEqual(distance(np.array([[42.0, 23.0], [43.0, 23.0]])), 111195, -1)
+        self.assertEqual(distance(np.zeros((1, 2))), 0.0)
+
+    def test_climb(self):
+        self.assertEqual(climb(np.array([100, np.nan, 110, 105])), (10.0, 5.0))
+        ascent, descent = climb(np.array([100.0, 102, 100, 102, 100, 102, 100, 102, 100, 102]))
+        self.assertLess(ascent, 2)
+
+    def test_segments_stats(self):
+        stats = segments_stats(list(iter_segments(io.BytesIO(GPX))))
+        self.assertEqual(stats, {'distance': 2.22, 'ascent': 20, 'descent': 0, 'points': 3})
+
+    def test_check_stats(self):
+        stats = {'distance': 20.0, 'ascent': 300, 'descent': 300, 'points': 10}
+        self.assertEqual(check_stats({'length': Decimal(21), 'ascent': Decimal(350)}, stats), [])
+        self.assertEqual(len(check_stats({'length': Decimal(10), 'ascent': Decimal(900)}, stats)), 2)
+        self.assertEqual(check_stats({'ascent': Decimal(-900)}, stats), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
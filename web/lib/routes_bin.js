@@ -0,0 +1,76 @@
+/*
+ * Decoder for the packed route geometry written by preprocessor/binary_format.py.
+ *
+ *   routesBin.load('routes.bin', function (routes) {
+ *       // routes[i] is an array of segments, each an Int32Array of interleaved
+ *       // latitude, longitude in 1e-5 degrees.
+ *       var latLngs = routesBin.toLatLngs(routes[0][0]);
+ *   });
+ */
+var routesBin = (function () {
+    var PRECISION = 1e5;
+
+    function decode(buffer) {
+        var bytes = new Uint8Array(buffer);
+        var view = new DataView(buffer);
+        if (String.fromCharCode(bytes[0], bytes[1], bytes[2], bytes[3]) !== 'MTBR') {
+            throw new Error('Not a routes.bin file');
+        }
+        var pos;
+        var readVarint = function () {
+            var result = 0, factor = 1, b;
+            do {
+                b = bytes[pos++];
+                result += (b & 0x7f) * factor;
+                factor *= 128;
+            } while (b & 0x80);
+            return result;
+        };
+        var readDelta = function () {
+            var v = readVarint();
+            return v % 2 ? -(v + 1) / 2 : v / 2;
+        };
+        var count = view.getUint32(buffer.byteLength - 4, true);
+        var table = buffer.byteLength - 4 - 4 * count;
+        var routes = new Array(count);
+        for (var i = 0; i < count; i++) {
+            pos = view.getUint32(table + 4 * i, true);
+            var segments = new Array(readVarint());
+            for (var s = 0; s < segments.length; s++) {
+                var coords = new Int32Array(readVarint() * 2);
+                var lat = 0, lon = 0;
+                for (var p = 0; p < coords.length; p += 2) {
+                    coords[p] = lat += readDelta();
+                    coords[p + 1] = lon += readDelta();
+                }
+                segments[s] = coords;
+            }
+            routes[i] = segments;
+        }
+        return routes;
+    }
+
+    function toLatLngs(coords) {
+        var result = new Array(coords.length / 2);
+        for (var p = 0; p < coords.length; p += 2) {
+            result[p / 2] = [coords[p] / PRECISION, coords[p + 1] / PRECISION];
+        }
+        return result;
+    }
+
+    function load(url, callback) {
+        var xhr = new XMLHttpRequest();
+        xhr.open('GET', url);
+        xhr.responseType = 'arraybuffer';
+        xhr.onload = function () {
+            callback(decode(xhr.response));
+        };
+        xhr.send();
+    }
+
+    return {
+        decode: decode,
+        toLatLngs: toLatLngs,
+        load: load
+    };
+})();